@@ -0,0 +1,363 @@
+import itertools
+from datetime import datetime, time as day_time, timedelta
+from flask import Blueprint, Response, abort, current_app, flash, jsonify, redirect, render_template, request, send_from_directory, stream_with_context, url_for
+from werkzeug.security import generate_password_hash
+from models import *
+from forms import *
+from auth import check_role
+from audit import audit_log
+from database import read_only
+from tree_cache import tree_cache
+from skill_index import skill_index
+from pagination import InvalidCursor, decode_cursor, encode_cursor, prefix_range
+from fragment_cache import fragment_cache
+from metrics import metrics
+from profiler import profiler
+import audit_archive
+import bulk_import
+import export
+import click
+
+# commands are registered at the top level: `flask archive-audit`, not `flask admin archive-audit`
+bp = Blueprint('admin', __name__, cli_group=None)
+
+USERS_PER_PAGE = 50
+MAX_USERS_PER_PAGE = 500
+AUDIT_ENTRIES_PER_PAGE = 100
+ANALYTICS_TOP_SKILLS = 50
+TREND_POINTS = 12
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+@bp.route('/users', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def users():
+    form = UserFilterForm(request.args)
+    try:
+        users, next_cursor = list_users(form, request.args.get('after'), USERS_PER_PAGE)
+    except InvalidCursor:
+        abort(400)
+    next_args = dict(request.args.items(multi=False), after=next_cursor) if next_cursor else None
+    return render_template('users.html', users=users, form=form, next_args=next_args)
+
+@bp.route('/api/users', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def users_api():
+    form = UserFilterForm(request.args)
+    if not form.validate():
+        return jsonify({'error': 'Invalid data', 'details': form.errors}), 400
+
+    limit = max(1, min(request.args.get('limit', USERS_PER_PAGE, type=int), MAX_USERS_PER_PAGE))
+    try:
+        users, next_cursor = list_users(form, request.args.get('after'), limit)
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'users': [user.to_dict() for user in users], 'next': next_cursor})
+
+def list_users(form, after, limit):
+    # keyset pagination on (surname, id); invalid filters are ignored
+    form.validate()
+    query = User.query
+
+    if form.q.data and form.q.data.strip():
+        q = form.q.data.strip()
+        query = query.filter(
+            prefix_range(db.func.lower(User.surname), q) |
+            prefix_range(db.func.lower(User.name), q) |
+            prefix_range(db.func.lower(User.email), q)
+        )
+    if form.role.data:
+        query = query.filter(User.role == form.role.data)
+    if form.senior.data:
+        query = query.filter(User.senior.is_(form.senior.data == 'yes'))
+    if form.accepted_privacy.data:
+        query = query.filter(User.accepted_privacy.is_(form.accepted_privacy.data == 'yes'))
+    if form.last_login_from.data and not form.last_login_from.errors:
+        query = query.filter(User.last_login >= datetime.combine(form.last_login_from.data, day_time.min))
+    if form.last_login_to.data and not form.last_login_to.errors:
+        query = query.filter(User.last_login <= datetime.combine(form.last_login_to.data, day_time.max))
+
+    cursor = decode_cursor(after, (str, type(None)), int)
+    if cursor:
+        surname, user_id = cursor
+        # the bound on the first term alone is what lets SQLite seek the index: it doesn't
+        # for a row value over an expression
+        query = query.filter(USER_SORT_SURNAME >= (surname or ''),
+                             db.tuple_(USER_SORT_SURNAME, User.id) > db.tuple_(surname or '', user_id))
+
+    users = query.order_by(USER_SORT_SURNAME, User.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor([users[-1].surname or '', users[-1].id])
+    return users, next_cursor
+
+@bp.route('/audit', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def audit():
+    form = AuditFilterForm(request.args)
+    form.validate()
+    email = (form.email.data or '').strip()
+    action = (form.action.data or '').strip()
+    start = datetime.combine(form.date_from.data, day_time.min) if form.date_from.data else None
+    end = datetime.combine(form.date_to.data, day_time.max) if form.date_to.data else None
+    try:
+        cursor = decode_cursor(request.args.get('after'), str, int)
+        timestamp = datetime.fromisoformat(cursor[0]) if cursor else None
+    except ValueError:
+        # InvalidCursor, or a cursor whose timestamp is not one
+        abort(400)
+
+    if form.archived.data:
+        # oldest first, streamed from the monthly segments
+        records = audit_archive.search_archive(current_app.config['AUDIT_ARCHIVE_DIR'], email, action, start, end, cursor)
+        entries = list(itertools.islice(records, AUDIT_ENTRIES_PER_PAGE + 1))
+    else:
+        # newest first, keyset on (timestamp, id)
+        query = AuditLog.query
+        if email:
+            query = query.filter(AuditLog.email == email)
+        if action:
+            query = query.filter(AuditLog.action == action)
+        if start:
+            query = query.filter(AuditLog.timestamp >= start)
+        if end:
+            query = query.filter(AuditLog.timestamp <= end)
+        if cursor:
+            query = query.filter(db.tuple_(AuditLog.timestamp, AuditLog.id) < db.tuple_(timestamp, cursor[1]))
+        logs = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(AUDIT_ENTRIES_PER_PAGE + 1).all()
+        entries = [log.to_dict() for log in logs]
+
+    next_args = None
+    if len(entries) > AUDIT_ENTRIES_PER_PAGE:
+        entries = entries[:AUDIT_ENTRIES_PER_PAGE]
+        last = entries[-1]
+        next_args = dict(request.args.items(multi=False), after=encode_cursor([last['timestamp'], last['id']]))
+    return render_template('audit.html', form=form, entries=entries, next_args=next_args)
+
+@bp.cli.command('archive-audit')
+@click.option('--days', type=int, default=None, help='Keep this many days in the database (default AUDIT_RETENTION_DAYS).')
+def archive_audit_command(days):
+    """Move old audit log entries to the monthly archive segments."""
+    days = current_app.config['AUDIT_RETENTION_DAYS'] if days is None else days
+    before = datetime.now() - timedelta(days=days)
+    archived = audit_archive.archive_audit_log(current_app.config['AUDIT_ARCHIVE_DIR'], before)
+    if archived:
+        audit_log(action='archive audit log', data={'count': archived, 'before': before.isoformat(sep=' ')})
+    click.echo(f'{archived} audit entries archived to {current_app.config["AUDIT_ARCHIVE_DIR"]}')
+
+@bp.cli.command('compact-history')
+def compact_history_command():
+    """Purge revoked users from the history and fold the new skill level events into a snapshot."""
+    import history
+    snapshot, events, purged = history.compact_history(current_app.config['HISTORY_DIR'])
+    if purged:
+        click.echo(f'{len(purged)} users purged from the history snapshots')
+    if snapshot is None:
+        click.echo('No new skill level events')
+        return
+    click.echo(f'{events} skill level events compacted into {snapshot.path}')
+
+@bp.route('/api/history/levels', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def history_levels():
+    import history
+
+    form = HistoryFilterForm(request.args)
+    if not form.validate():
+        return jsonify({'error': 'Invalid data', 'details': form.errors}), 400
+
+    at = datetime.combine(form.at.data or datetime.now().date(), day_time.max)
+    levels = history.levels_as_of(current_app.config['HISTORY_DIR'], at, form.user_id.data, form.skill_id.data)
+    return jsonify({
+        'at': at.isoformat(sep=' '),
+        'levels': [{'user_id': user_id, 'skill_id': skill_id, 'level': level} for user_id, skill_id, level in levels],
+    })
+
+@bp.route('/api/history/skills/<int:skill_id>/trend', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def history_trend(skill_id):
+    import history
+
+    form = HistoryFilterForm(request.args)
+    if not form.validate():
+        return jsonify({'error': 'Invalid data', 'details': form.errors}), 400
+
+    end = form.date_to.data or datetime.now().date()
+    start = form.date_from.data or end - timedelta(days=365)
+    if start > end:
+        return jsonify({'error': 'Invalid data', 'details': {'date_from': ['Must not be after date_to']}}), 400
+
+    # evenly spaced days, each counted at its end
+    count = form.points.data or TREND_POINTS
+    days = [start + timedelta(days=round(number * (end - start).days / max(count - 1, 1))) for number in range(count)]
+    days = sorted(set(days))
+    points = [datetime.combine(day, day_time.max) for day in days]
+    trend = history.skill_trend(current_app.config['HISTORY_DIR'], skill_id, points)
+    return jsonify({
+        'skill_id': skill_id,
+        'trend': [{
+            'date': day.isoformat(),
+            'holders': sum(levels),
+            'avg_level': round(sum(level * count for level, count in zip(LEVELS, levels)) / sum(levels), 1) if sum(levels) else 0,
+            'levels': levels,
+        } for day, levels in zip(days, trend)],
+    })
+
+@bp.route('/create_user', methods=['GET', 'POST'])
+@check_role(['admin'])
+def create_user():
+    form = CreateUserForm()
+    if form.validate_on_submit():
+        name = form.name.data
+        surname = form.surname.data
+        email = form.email.data
+        hashed_password = generate_password_hash(form.password.data)
+        role = form.role.data
+        new_user = User(
+            name=name,
+            surname=surname,
+            email=email,
+            password=hashed_password,
+            role=role
+        )
+        db.session.add(new_user)
+        db.session.commit()
+        return redirect(url_for('admin.users'))
+    else:
+        flash_errors(form)
+    return render_template('create_user.html', form=form)
+
+@bp.route('/import_users', methods=['GET', 'POST'])
+@check_role(['admin'])
+def import_users():
+    form = ImportUsersForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        result = bulk_import.import_users(
+            upload.stream,
+            upload.filename,
+            create_taxonomy=form.create_taxonomy.data,
+            dry_run=form.dry_run.data
+        )
+    else:
+        flash_errors(form)
+    return render_template('import_users.html', form=form, result=result)
+
+@bp.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--create-taxonomy', is_flag=True, help='Create missing categories and skills.')
+@click.option('--dry-run', is_flag=True, help='Only validate the file.')
+@click.option('--workers', type=int, default=None, help='Password hashing processes.')
+def import_users_command(path, create_taxonomy, dry_run, workers):
+    """Import users from a CSV or JSONL file."""
+    with open(path, 'rb') as stream:
+        result = bulk_import.import_users(stream, path, create_taxonomy, dry_run, workers)
+    for line, email, messages in result.errors:
+        click.echo(f'line {line} ({email}): {"; ".join(messages)}', err=True)
+    click.echo(f'{result.created} users imported, {len(result.errors)} rows rejected, '
+               f'{result.categories_created} categories and {result.skills_created} skills created')
+
+@bp.route('/api/fragment_cache', methods=['GET'])
+@check_role(['admin'])
+def fragment_cache_stats():
+    return jsonify(fragment_cache.stats())
+
+@bp.route('/metrics', methods=['GET'])
+@check_role(['admin'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/analytics', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def analytics():
+    from analytics import BUS_FACTOR, EXPERT_LEVEL, coverage_cache
+
+    coverage = coverage_cache.get()
+    top_skills = sorted(coverage.skills, key=lambda skill: (-skill.holders, skill.skill.name))[:ANALYTICS_TOP_SKILLS]
+    return render_template('analytics.html', coverage=coverage, top_skills=top_skills, at_risk=coverage.at_risk,
+                           bus_factor=BUS_FACTOR, expert_level=EXPERT_LEVEL)
+
+@bp.route('/profiler', methods=['GET', 'POST'])
+@check_role(['admin'])
+def profiler_settings():
+    form = profiler_form()
+    if form.validate_on_submit():
+        profiler.save_settings(form.rates)
+        audit_log(action='update profiler', data={'endpoints': form.rates})
+        flash('Profiler settings saved', 'success')
+        return redirect(url_for('admin.profiler_settings'))
+    flash_errors(form)
+    return render_template('profiler.html', form=form, profiles=profiler.profiles())
+
+def profiler_form():
+    form = ProfilerForm()
+    if not form.is_submitted():
+        form.endpoints.data = '\n'.join(f'{endpoint} {rate}' for endpoint, rate in profiler.load_settings().items())
+    return form
+
+def saved_profile(name):
+    if name not in {profile['name'] for profile in profiler.profiles()}:
+        abort(404)
+    return name
+
+@bp.route('/profiler/<name>', methods=['GET'])
+@check_role(['admin'])
+def profile_report(name):
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in PROFILE_SORT_KEYS:
+        sort = 'cumulative'
+    report = profiler.report(saved_profile(name), sort=sort)
+    return render_template('profiler.html', form=profiler_form(), profiles=profiler.profiles(), report=report, report_name=name)
+
+@bp.route('/profiler/<name>/download', methods=['GET'])
+@check_role(['admin'])
+def profile_download(name):
+    return send_from_directory(current_app.config['PROFILER_DIR'], saved_profile(name), as_attachment=True)
+
+@bp.route('/toggle_senior', methods=['POST'])
+@check_role(['admin'])
+def toggle_senior():
+    form = ToggleSeniorForm()
+    if form.validate_on_submit():
+        user_id = form.user_id.data
+        user = User.query.get_or_404(user_id)
+        user.senior = not user.senior
+        version = bump_version(db.session.connection(), USERS)
+        db.session.commit()
+        skill_index.set_senior(user.id, user.senior, version)
+    return redirect(url_for('admin.users'))
+
+@bp.route('/export', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def export_skills():
+    layout = request.args.get('layout', 'wide')
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    if (layout, fmt) not in export.EXPORTS:
+        flash('Unknown export layout or format', 'error')
+        return redirect(url_for('admin.users'))
+
+    audit_log(action='export skills', data={'layout': layout, 'format': fmt})
+
+    chunks = export.EXPORTS[layout, fmt](tree_cache.get())
+    filename = f'skills-{layout}-{datetime.now():%Y%m%d}.{fmt}'
+    mimetype = export.MIMETYPES[fmt]
+    if compress:
+        chunks = export.gzipped(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
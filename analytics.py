@@ -0,0 +1,180 @@
+import itertools
+import threading
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+from models import db, User, UserSkill, LEVELS, TAXONOMY, USER_SKILLS, USERS, get_versions
+from tree_cache import tree_cache
+
+# Skill coverage analytics. UserSkill is loaded once into a sparse
+# user x skill matrix of levels and every figure is computed from it with
+# vectorized operations; category figures roll up whole subtrees through a
+# skill x category membership matrix. Results are cached per worker until one
+# of the data versions they depend on changes.
+
+EXPERT_LEVEL = 4
+BUS_FACTOR = 2 # skills with this many experts or fewer are at risk
+
+class SkillCoverage:
+    __slots__ = ('skill', 'path', 'holders', 'experts', 'senior_holders', 'junior_holders',
+                 'senior_avg_level', 'junior_avg_level', 'levels')
+
+class CategoryCoverage:
+    __slots__ = ('category', 'depth', 'skills', 'covered_skills', 'holders', 'experts', 'senior_holders', 'at_risk')
+
+class Coverage:
+    def __init__(self, versions, users, seniors, skills, categories):
+        self.versions = versions
+        self.users = users
+        self.seniors = seniors
+        self.skills = skills # SkillCoverage, in tree order
+        self.categories = categories # CategoryCoverage, in tree order
+
+    @property
+    def at_risk(self):
+        risky = [skill for skill in self.skills if skill.experts <= BUS_FACTOR]
+        return sorted(risky, key=lambda skill: (skill.experts, -skill.holders, skill.skill.name))
+
+def fetch_array(query, columns):
+    """The integer columns of a query as an int64 array of shape (rows, columns).
+
+    Read straight from the DBAPI cursor: building a Row per result row and
+    converting the Rows to an array costs ~25x more than the query itself.
+    """
+    result = db.session.connection().execute(query)
+    try:
+        data = np.fromiter(itertools.chain.from_iterable(result.cursor), dtype=np.int64)
+    finally:
+        result.close()
+    return data.reshape(-1, columns)
+
+def positions(ids, known):
+    """Position of every id in the known ids, and whether it is known at all."""
+    order = np.argsort(known)
+    index = np.searchsorted(known, ids, sorter=order)
+    if not len(known):
+        return index, np.zeros(len(ids), dtype=bool)
+    index = np.minimum(index, len(known) - 1)
+    return order[index], known[order[index]] == ids
+
+def load_matrix(skill_ids):
+    """Levels as a users x skills CSR matrix, columns in skill_ids order, with the user ids and their seniority."""
+    users = db.session.execute(select(User.id, User.senior).order_by(User.id)).all()
+    user_ids = np.fromiter((row.id for row in users), dtype=np.int64, count=len(users))
+    senior = np.fromiter((bool(row.senior) for row in users), dtype=bool, count=len(users))
+
+    data = fetch_array(select(UserSkill.user_id, UserSkill.skill_id, UserSkill.level).where(UserSkill.level > 0), 3)
+
+    # rows of users or skills that no longer exist are dropped
+    user_positions, known_users = positions(data[:, 0], user_ids)
+    skill_positions, known_skills = positions(data[:, 1], skill_ids)
+    valid = known_users & known_skills
+
+    matrix = sparse.csr_matrix(
+        (data[valid, 2].astype(np.int8), (user_positions[valid], skill_positions[valid])),
+        shape=(len(user_ids), len(skill_ids))
+    )
+    return matrix, user_ids, senior
+
+def compute(versions):
+    tree = tree_cache.get()
+
+    # skills and categories in tree order, with the depth of each category
+    skills = []
+    categories = []
+
+    def walk(nodes, depth):
+        for category in nodes:
+            categories.append((category, depth))
+            skills.extend(category.skills)
+            walk(category.children, depth + 1)
+
+    walk(tree.roots, 0)
+    skill_ids = np.array([skill.id for skill in skills], dtype=np.int64)
+    matrix, _, senior = load_matrix(skill_ids)
+
+    held = (matrix > 0).astype(np.int32)
+    expert = (matrix >= EXPERT_LEVEL).astype(np.int32)
+    senior_rows = sparse.diags(senior.astype(np.int32), dtype=np.int32)
+
+    holders = np.asarray(held.sum(axis=0)).ravel()
+    experts = np.asarray(expert.sum(axis=0)).ravel()
+    senior_holders = np.asarray((senior_rows @ held).sum(axis=0)).ravel()
+    level_sums = np.asarray(matrix.astype(np.int32).sum(axis=0)).ravel()
+    senior_level_sums = np.asarray((senior_rows @ matrix.astype(np.int32)).sum(axis=0)).ravel()
+    levels = np.vstack([np.asarray((matrix == level).sum(axis=0)).ravel() for level in LEVELS])
+
+    junior_holders = holders - senior_holders
+    with np.errstate(divide='ignore', invalid='ignore'):
+        senior_avg = np.where(senior_holders > 0, senior_level_sums / senior_holders, 0)
+        junior_avg = np.where(junior_holders > 0, (level_sums - senior_level_sums) / junior_holders, 0)
+
+    skill_coverage = []
+    for position, skill in enumerate(skills):
+        item = SkillCoverage()
+        item.skill = skill
+        item.path = tree.categories[skill.category_id].path
+        item.holders = int(holders[position])
+        item.experts = int(experts[position])
+        item.senior_holders = int(senior_holders[position])
+        item.junior_holders = int(junior_holders[position])
+        item.senior_avg_level = round(float(senior_avg[position]), 2)
+        item.junior_avg_level = round(float(junior_avg[position]), 2)
+        item.levels = [int(count) for count in levels[:, position]]
+        skill_coverage.append(item)
+
+    # membership[s, c] = 1 when skill s is in the subtree of category c
+    category_index = {category.id: position for position, (category, _) in enumerate(categories)}
+    members_rows = []
+    members_columns = []
+    for position, skill in enumerate(skills):
+        category = tree.categories.get(skill.category_id)
+        while category is not None:
+            members_rows.append(position)
+            members_columns.append(category_index[category.id])
+            category = tree.categories.get(category.parent_id)
+    membership = sparse.csr_matrix(
+        (np.ones(len(members_rows), dtype=np.int32), (members_rows, members_columns)),
+        shape=(len(skills), len(categories))
+    )
+
+    # a user counts once per subtree, however many of its skills they hold
+    subtree_holders = np.asarray(((held @ membership) > 0).sum(axis=0)).ravel()
+    subtree_experts = np.asarray(((expert @ membership) > 0).sum(axis=0)).ravel()
+    subtree_seniors = np.asarray(((senior_rows @ held @ membership) > 0).sum(axis=0)).ravel()
+    subtree_skills = np.asarray(membership.sum(axis=0)).ravel()
+    subtree_covered = (holders > 0).astype(np.int32) @ membership
+    subtree_at_risk = (experts <= BUS_FACTOR).astype(np.int32) @ membership
+
+    category_coverage = []
+    for position, (category, depth) in enumerate(categories):
+        item = CategoryCoverage()
+        item.category = category
+        item.depth = depth
+        item.skills = int(subtree_skills[position])
+        item.covered_skills = int(subtree_covered[position])
+        item.holders = int(subtree_holders[position])
+        item.experts = int(subtree_experts[position])
+        item.senior_holders = int(subtree_seniors[position])
+        item.at_risk = int(subtree_at_risk[position])
+        category_coverage.append(item)
+
+    return Coverage(versions, matrix.shape[0], int(senior.sum()), skill_coverage, category_coverage)
+
+class CoverageCache:
+    def __init__(self):
+        self._coverage = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        versions = get_versions(TAXONOMY, USER_SKILLS, USERS)
+        coverage = self._coverage
+        if coverage is not None and coverage.versions == versions:
+            return coverage
+
+        with self._lock:
+            if self._coverage is None or self._coverage.versions != versions:
+                self._coverage = compute(versions)
+            return self._coverage
+
+coverage_cache = CoverageCache()
@@ -0,0 +1,147 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from models import db, AuditLog, PENDING_AUDIT_RECORDS, audit_record
+
+# Audit records are buffered in memory and written by a background thread in
+# batches, so a request doesn't pay a second commit (and a second fsync) just
+# for its audit row. A batch is written as soon as it is full or its oldest
+# record is AUDIT_FLUSH_INTERVAL seconds old. With AUDIT_SYNC every record is
+# written before submit() returns.
+
+_STOP = object()
+
+class AuditWriter:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_SYNC', False)
+        app.config.setdefault('AUDIT_BATCH_SIZE', 200)
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', 0.5)
+        app.config.setdefault('AUDIT_QUEUE_SIZE', 10000)
+        if self.app is None:
+            atexit.register(self.close)
+        self.app = app
+
+    @property
+    def sync(self):
+        return self.app.config['AUDIT_SYNC']
+
+    def submit(self, records):
+        if self.sync:
+            self._write(records)
+            return
+
+        self._start()
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                # never drop an audit record, write it on the caller's thread instead
+                self._write([record])
+
+    def flush(self):
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout=10)
+
+    def _start(self):
+        # started lazily, and again after a fork: threads don't survive it
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.app.config['AUDIT_QUEUE_SIZE'])
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        batch_size = self.app.config['AUDIT_BATCH_SIZE']
+        interval = self.app.config['AUDIT_FLUSH_INTERVAL']
+        stopping = False
+
+        while not stopping:
+            record = self._queue.get()
+            if record is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [record]
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(record)
+
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, records):
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(insert(AuditLog), records)
+        except Exception:
+            # keep a trace of what could not be stored
+            self.app.logger.exception('Failed to write %d audit records', len(records))
+            for record in records:
+                self.app.logger.error('Audit record: %s', json.dumps(record, default=str))
+
+audit_writer = AuditWriter()
+
+def audit_log(action, data):
+    audit_writer.submit([audit_record(action, data)])
+
+# after_commit fires while the session still holds its writer connection: a
+# synchronous write (AUDIT_SYNC, or a full queue) there would wait for another
+# one from the pool, which concurrent commits may have taken. The committed
+# records are submitted once the transaction has given its connection back.
+COMMITTED_AUDIT_RECORDS = 'committed_audit_records'
+
+@event.listens_for(Session, 'after_commit')
+def keep_committed_audit_records(session):
+    records = session.info.pop(PENDING_AUDIT_RECORDS, None)
+    if records:
+        session.info.setdefault(COMMITTED_AUDIT_RECORDS, []).extend(records)
+
+@event.listens_for(Session, 'after_transaction_end')
+def submit_committed_audit_records(session, transaction):
+    if transaction.parent is not None:
+        return
+    records = session.info.pop(COMMITTED_AUDIT_RECORDS, None)
+    if records:
+        audit_writer.submit(records)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_audit_records(session):
+    session.info.pop(PENDING_AUDIT_RECORDS, None)
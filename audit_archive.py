@@ -0,0 +1,82 @@
+import gzip
+import json
+import os
+from sqlalchemy import delete, select
+from models import db, AuditLog
+
+# Retention for the audit log: rows older than the horizon are moved out of the
+# database into one gzip JSONL segment per month (instance/audit/YYYY-MM.jsonl.gz).
+# Segments are append-only, every archiving run adds a new gzip member, and are
+# searched by streaming them in (timestamp, id) order.
+#
+# A batch is written to its segments before it is deleted from the table. If the
+# process dies in between, the batch is archived again on the next run and may
+# show up twice in archive searches, but it is never lost.
+
+ARCHIVE_BATCH_SIZE = 5000
+SEGMENT_SUFFIX = '.jsonl.gz'
+
+def segment_path(directory, month):
+    return os.path.join(directory, month + SEGMENT_SUFFIX)
+
+def segment_months(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+def append_segment(directory, month, records):
+    with open(segment_path(directory, month), 'ab') as stream:
+        with gzip.GzipFile(fileobj=stream, mode='wb') as segment:
+            for record in records:
+                segment.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+        stream.flush()
+        os.fsync(stream.fileno())
+
+def archive_audit_log(directory, before):
+    """Move audit rows older than before into the monthly segments, returns how many were moved."""
+    os.makedirs(directory, exist_ok=True)
+    archived = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(
+                select(AuditLog.__table__)
+                .where(AuditLog.timestamp < before)
+                .order_by(AuditLog.timestamp, AuditLog.id)
+                .limit(ARCHIVE_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return archived
+
+            months = {}
+            for row in rows:
+                record = AuditLog(**row._mapping).to_dict()
+                months.setdefault(row.timestamp.strftime('%Y-%m'), []).append(record)
+            for month, records in months.items():
+                append_segment(directory, month, records)
+
+            connection.execute(delete(AuditLog).where(AuditLog.id.in_([row.id for row in rows])))
+            archived += len(rows)
+
+def search_archive(directory, email=None, action=None, start=None, end=None, after=None):
+    """Stream archived records matching the filters, oldest first.
+
+    start and end are inclusive datetimes, after is the [timestamp, id] of the
+    last record already seen.
+    """
+    start = start.isoformat(sep=' ', timespec='microseconds') if start else None
+    end = end.isoformat(sep=' ', timespec='microseconds') if end else None
+
+    for month in segment_months(directory):
+        if (start and month < start[:7]) or (end and month > end[:7]) or (after and month < after[0][:7]):
+            continue
+        with gzip.open(segment_path(directory, month), 'rt', encoding='utf-8') as segment:
+            for line in segment:
+                record = json.loads(line)
+                timestamp = record['timestamp']
+                if after and [timestamp, record['id']] <= after:
+                    continue
+                if (start and timestamp < start) or (end and timestamp > end):
+                    continue
+                if (email and record['email'] != email) or (action and record['action'] != action):
+                    continue
+                yield record
@@ -0,0 +1,149 @@
+import sys
+import time
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, flash, redirect, render_template, url_for, session
+from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import delete
+from models import *
+from forms import *
+from audit import audit_log
+from skill_index import skill_index
+
+bp = Blueprint('auth', __name__)
+
+def check_role(required_roles):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # if user is not logged in, redirect to login page
+            if 'id' not in session:
+                return redirect(url_for('auth.login'))
+            # if user is not in the required roles, redirect to index
+            elif session['role'] not in required_roles:
+                return redirect(url_for('skills.index'))
+            # privacy is important
+            elif session['accepted_privacy'] is False:
+                return redirect(url_for('auth.privacy'))
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@bp.route('/install', methods=['GET'])
+def install():
+    existing_user = User.query.first()
+    if not existing_user:
+        admin_user = User(
+            name='admin',
+            surname='admin',
+            email='admin@admin.it',
+            role='admin',
+            accepted_privacy=True,
+            password=generate_password_hash('admin')
+            )
+        db.session.add(admin_user)
+        db.session.commit()
+        audit_log(
+            action='create admin',
+            data={
+                'name': admin_user.name,
+                'surname': admin_user.surname,
+                'email': admin_user.email
+            }
+        )
+
+    return redirect(url_for('auth.login'))
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if 'id' in session:
+        return redirect(url_for('skills.index'))
+
+    form = LoginForm()
+    if form.validate_on_submit():
+        email = form.email.data
+        password = form.password.data
+        user = User.query.filter_by(email=email).first()
+        if user and check_password_hash(user.password, password):
+            session['id'] = user.id
+            session['email'] = user.email
+            session['name'] = user.name
+            session['surname'] = user.surname
+            session['accepted_privacy'] = user.accepted_privacy
+            session['role'] = user.role
+            session['logged_in_at'] = time.time()
+
+            user.last_login = datetime.now()
+            db.session.commit()
+            audit_log(
+                action='login',
+                data={
+                    'name': user.name,
+                    'surname': user.surname,
+                    'role': user.role
+                }
+            )
+
+            return redirect(url_for('skills.index'))
+        else:
+            flash('Invalid email or password', 'error')
+            return redirect(url_for('auth.login'))
+    return render_template('login.html', form=form)
+
+@bp.route('/logout', methods=['GET'])
+def logout():
+    session.clear()
+    return redirect(url_for('auth.login'))
+
+@bp.route('/privacy', methods=['GET', 'POST'])
+def privacy():
+    form = PrivacyForm()
+    if form.validate_on_submit():
+        accepted_privacy = form.accepted_privacy.data
+        if accepted_privacy == 'True':
+            user = User.query.get_or_404(session.get('id'))
+            user.accepted_privacy = True
+            db.session.commit()
+            session['accepted_privacy'] = True
+            audit_log(
+                action='accept privacy',
+                data={
+                    'name': user.name,
+                    'surname': user.surname,
+                }
+            )
+            return redirect(url_for('skills.index'))
+    return render_template('privacy.html', form=form)
+
+@bp.route('/removeprivacy', methods=['GET', 'POST'])
+@check_role(['user'])
+def remove_privacy():
+    form = RemovePrivacyForm()
+    if form.validate_on_submit():
+        if form.revoke_consent.data:
+            user = User.query.get_or_404(session.get('id'))
+            user.accepted_privacy = False
+            skill_ids = db.session.execute(
+                delete(UserSkill).where(UserSkill.user_id == user.id).returning(UserSkill.skill_id)
+            ).scalars().all()
+            db.session.execute(delete(SkillLevelEvent).where(SkillLevelEvent.user_id == user.id))
+            # the snapshots are purged by the next compaction, recorded here so it can't be lost
+            db.session.merge(HistoryPurge(user_id=user.id, requested_at=datetime.now()))
+            version = bump_version(db.session.connection(), USER_SKILLS)
+            bump_versions(db.session.connection(), [user_key(user.id)] + [skill_key(skill_id) for skill_id in skill_ids])
+            db.session.commit()
+            skill_index.remove_user(user.id, version)
+            # nothing to update in a worker that has not built its recommendations yet
+            if 'recommendations' in sys.modules:
+                from recommendations import recommendations
+                recommendations.remove_user(user.id, version)
+            session['accepted_privacy'] = False
+            audit_log(
+                action='revoke privacy',
+                data={
+                    'user_id': user.id,
+                    'name': user.name,
+                    'surname': user.surname,
+                })
+            return redirect(url_for('skills.index'))
+    return render_template('remove_privacy.html', form=form)
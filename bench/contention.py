@@ -0,0 +1,152 @@
+"""Measure throughput under concurrent workers sharing the SQLite database.
+
+    SKILLZ_DATABASE_URI=sqlite:///bench.db python bench/contention.py --workers 1 2 4 8
+    SKILLZ_DATABASE_URI=sqlite:///bench.db python bench/contention.py --untuned --output bench/results/untuned.json
+
+Every worker is a separate process, like a gunicorn worker, serving a mix of
+page views and level changes through Flask's test client for --duration
+seconds. The report has the requests per second of every worker count, the
+95th percentile latency of reads and writes and the requests that failed,
+"database is locked" ones counted apart. --untuned runs with the settings the
+app had before the engine profile: rollback journal, full fsync and deferred
+write transactions. Write requests change levels in the benchmark database.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from run import Sample, login, percentile
+
+UNTUNED = {
+    'SQLITE_JOURNAL_MODE': 'DELETE',
+    'SQLITE_SYNCHRONOUS': 'FULL',
+    'SQLITE_IMMEDIATE_WRITES': False,
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='worker counts to measure')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per worker count')
+    parser.add_argument('--writes', type=float, default=0.2, help='fraction of requests that change a level')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--untuned', action='store_true', help='measure without the engine profile')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    return parser.parse_args(argv)
+
+def requests(sample):
+    reads = [
+        lambda: ('GET', '/', None),
+        lambda: ('GET', f'/skill_details/{sample.skill()}', None),
+        lambda: ('GET', f'/search?q=Skill+{sample.rng.randint(1, 99)}', None),
+    ]
+    write = lambda: ('POST', '/set_skill', {'skill_id': sample.skill(), 'level': sample.rng.randint(0, 5)})
+    return reads, write
+
+def worker(number, args, start_at, results):
+    import config
+    if args.untuned:
+        for name, value in UNTUNED.items():
+            setattr(config, name, value)
+
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from audit import audit_writer
+    from models import db
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    rng = random.Random(args.seed * 1000 + number)
+    with app.app_context():
+        sample = Sample(rng)
+        db.session.remove()
+    reads, write = requests(sample)
+    client = app.test_client()
+    login(client, sample.user('user'))
+
+    latencies = {'read': [], 'write': []}
+    errors = locked = 0
+    time.sleep(max(0, start_at - time.time()))
+    deadline = start_at + args.duration
+    while time.time() < deadline:
+        kind = 'write' if rng.random() < args.writes else 'read'
+        method, url, body = write() if kind == 'write' else rng.choice(reads)()
+        started = time.perf_counter()
+        try:
+            response = client.open(url, method=method, json=body)
+            response.get_data()
+            failed = response.status_code >= 500
+        except OperationalError as error:
+            failed = True
+            locked += 'database is locked' in str(error)
+        errors += failed
+        if not failed:
+            latencies[kind].append(time.perf_counter() - started)
+    audit_writer.flush()
+    results.put({'latencies': latencies, 'errors': errors, 'locked': locked})
+
+def measure(args, workers):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    # the workers import the app before the clock starts
+    start_at = time.time() + 5 + workers
+    processes = [context.Process(target=worker, args=(number, args, start_at, results)) for number in range(workers)]
+    for process in processes:
+        process.start()
+    # a worker that died never reports, give up instead of waiting forever
+    reports = [results.get(timeout=start_at - time.time() + args.duration + 120) for _ in processes]
+    for process in processes:
+        process.join()
+
+    reads = [latency for report in reports for latency in report['latencies']['read']]
+    writes = [latency for report in reports for latency in report['latencies']['write']]
+    return {
+        'workers': workers,
+        'requests_per_second': round((len(reads) + len(writes)) / args.duration, 1),
+        'reads_per_second': round(len(reads) / args.duration, 1),
+        'writes_per_second': round(len(writes) / args.duration, 1),
+        'read_p95_ms': round(percentile(reads, 0.95) * 1000, 2) if reads else None,
+        'write_p95_ms': round(percentile(writes, 0.95) * 1000, 2) if writes else None,
+        'errors': sum(report['errors'] for report in reports),
+        'locked': sum(report['locked'] for report in reports),
+    }
+
+def set_journal_mode(args):
+    # the journal mode is stored in the file, switch it once before the workers connect;
+    # the schema is brought up to date here too, like `flask init-db` before a deployment
+    import config
+    if args.untuned:
+        for name, value in UNTUNED.items():
+            setattr(config, name, value)
+    from app import create_app
+    from migrations import init_db
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+        with db.engine.connect() as connection:
+            return connection.exec_driver_sql(f'PRAGMA journal_mode = {app.config["SQLITE_JOURNAL_MODE"]}').scalar()
+
+if __name__ == '__main__':
+    args = parse_args()
+    journal_mode = set_journal_mode(args)
+    print(f'journal mode {journal_mode}, {args.duration:g}s per run, {args.writes:.0%} writes')
+    runs = []
+    for workers in args.workers:
+        result = measure(args, workers)
+        runs.append(result)
+        print(f'{workers:3} workers  {result["requests_per_second"]:8.1f} req/s  '
+              f'read p95 {result["read_p95_ms"]} ms  write p95 {result["write_p95_ms"]} ms  '
+              f'errors {result["errors"]} ({result["locked"]} locked)')
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as stream:
+            json.dump({'untuned': args.untuned, 'journal_mode': journal_mode, 'settings': vars(args), 'runs': runs},
+                      stream, indent=2)
@@ -0,0 +1,216 @@
+"""Drive the main routes through Flask's test client and record their cost.
+
+    SKILLZ_DATABASE_URI=sqlite:///bench.db python bench/run.py --output bench/results/today.json
+    python bench/run.py --compare bench/results/before.json bench/results/today.json
+
+Run it against a database built by bench/seed.py. For every scenario the
+report has latency percentiles, SQL queries per request and the peak memory
+allocated by Python while serving it (measured in a separate pass, tracemalloc
+slows everything down). Write requests change levels in the benchmark
+database, the other scenarios stay reproducible for a given --seed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import event, func, select
+
+MEMORY_REQUESTS = 5
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per scenario')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', action='append', default=[], help='run only these scenarios')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    return parser.parse_args(argv)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+class QueryCounter:
+    def __init__(self, engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+def scenarios(sample):
+    # name -> (role, function returning (method, url, json body))
+    return {
+        'index': ('user', lambda: ('GET', '/', None)),
+        'skills': ('user', lambda: ('GET', '/skills', None)),
+        'skills_tree': ('user', lambda: ('GET', f'/api/skills/tree/{sample.category()}', None)),
+        'search_tree': ('user', lambda: ('GET', '/search', None)),
+        'search_query': ('user', lambda: ('GET', f'/search?q=Skill+{sample.rng.randint(1, 99)}', None)),
+        'categories': ('admin', lambda: ('GET', '/categories', None)),
+        'show_skills': ('admin', lambda: ('GET', f'/showskills/{sample.leaf()}', None)),
+        'skill_details': ('user', lambda: ('GET', f'/skill_details/{sample.skill()}', None)),
+        'set_skill': ('user', lambda: ('POST', '/set_skill', {'skill_id': sample.skill(), 'level': sample.rng.randint(0, 5)})),
+    }
+
+class Sample:
+    """Random ids from the benchmark database."""
+
+    def __init__(self, rng):
+        from models import db, Category, Skill, User
+
+        self.rng = rng
+        self.skills = db.session.execute(select(Skill.id).order_by(Skill.id)).scalars().all()
+        self.categories = db.session.execute(select(Category.id).order_by(Category.id)).scalars().all()
+        self.leaves = sorted(set(db.session.execute(select(Skill.category_id)).scalars()))
+        self.users = db.session.execute(
+            select(User.id, User.email, User.role).where(User.accepted_privacy.is_(True)).order_by(User.id)
+        ).all()
+        if not self.skills or not self.users:
+            sys.exit('The benchmark database is empty, run bench/seed.py first')
+
+    def skill(self):
+        return self.rng.choice(self.skills)
+
+    def category(self):
+        return self.rng.choice(self.categories)
+
+    def leaf(self):
+        return self.rng.choice(self.leaves)
+
+    def user(self, role):
+        users = [user for user in self.users if user.role == role] or self.users
+        return self.rng.choice(users)
+
+def login(client, user):
+    with client.session_transaction() as session:
+        session.update(id=user.id, email=user.email, role=user.role, accepted_privacy=True,
+                       name='', surname='', logged_in_at=time.time())
+
+def request(client, method, url, body):
+    response = client.open(url, method=method, json=body)
+    response.get_data()
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method} {url} returned {response.status_code}')
+
+def run_scenario(app, counter, sample, role, make_request, args):
+    client = app.test_client()
+    login(client, sample.user(role))
+
+    for _ in range(args.warmup):
+        request(client, *make_request())
+
+    latencies = []
+    queries = []
+    for _ in range(args.requests):
+        method, url, body = make_request()
+        counter.count = 0
+        started = time.perf_counter()
+        request(client, method, url, body)
+        latencies.append(time.perf_counter() - started)
+        queries.append(counter.count)
+
+    tracemalloc.start()
+    for _ in range(MEMORY_REQUESTS):
+        tracemalloc.reset_peak()
+        request(client, *make_request())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries_mean': round(statistics.mean(queries), 2),
+        'queries_max': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(args):
+    from app import create_app
+    from audit import audit_writer
+    from migrations import init_db
+    from models import db, Category, Skill, User, UserSkill
+    from recommendations import recommendations
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = {}
+    with app.app_context():
+        init_db()
+        counter = QueryCounter(db.engines.values())
+        sample = Sample(random.Random(args.seed))
+        # otherwise built in the background after the first page view, alongside the timed requests
+        recommendations.rebuild()
+        counts = {
+            model.__tablename__: db.session.execute(select(func.count()).select_from(model)).scalar()
+            for model in (User, Category, Skill, UserSkill)
+        }
+        db.session.remove()
+
+        for name, (role, make_request) in scenarios(sample).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = run_scenario(app, counter, sample, role, make_request, args)
+            print(f'{name:15} p50 {results[name]["p50_ms"]:9.2f} ms  p95 {results[name]["p95_ms"]:9.2f} ms  '
+                  f'queries {results[name]["queries_mean"]:7.2f}  peak {results[name]["peak_memory_kb"]:9.1f} KB')
+        audit_writer.flush()
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'database': app.config['SQLALCHEMY_DATABASE_URI'],
+        'rows': counts,
+        'settings': {'requests': args.requests, 'warmup': args.warmup, 'seed': args.seed},
+        'scenarios': results,
+    }
+
+def compare(before_path, after_path):
+    with open(before_path) as stream:
+        before = json.load(stream)
+    with open(after_path) as stream:
+        after = json.load(stream)
+
+    print(f'{before.get("revision")} -> {after.get("revision")}')
+    for name, result in after['scenarios'].items():
+        previous = before['scenarios'].get(name)
+        if previous is None:
+            print(f'{name:15} new')
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p95_ms', 'queries_mean', 'peak_memory_kb'):
+            old, new = previous[metric], result[metric]
+            change = f'{(new - old) / old * 100:+.0f}%' if old else 'n/a'
+            changes.append(f'{metric} {old} -> {new} ({change})')
+        print(f'{name:15} ' + ', '.join(changes))
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        report = run(args)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w') as stream:
+                json.dump(report, stream, indent=2)
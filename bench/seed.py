@@ -0,0 +1,138 @@
+"""Build a synthetic organization to benchmark against.
+
+    SKILLZ_DATABASE_URI=sqlite:///bench.db python bench/seed.py --users 10000 --skills 3000
+
+The database named by SKILLZ_DATABASE_URI (relative sqlite paths live in the
+instance folder) is created if needed and must not contain users yet. The same arguments and --seed always give
+the same data. Every user, including the admin, has the password "password".
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+BATCH_SIZE = 5000
+ADMIN_EMAIL = 'admin@bench.local'
+PASSWORD = 'password'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=5, help='levels of the category tree')
+    parser.add_argument('--fanout', type=int, default=3, help='subcategories per category')
+    parser.add_argument('--skills', type=int, default=3000, help='skills, spread over the leaf categories')
+    parser.add_argument('--user-skills', type=int, default=300000, help='total UserSkill rows')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+def create_categories(depth, fanout):
+    from models import db, Category
+
+    # category names are unique, number them by their position in the tree
+    level = [(None, '')]
+    for _ in range(depth):
+        categories = [
+            (Category(name=f'Category {prefix}{number}', parent_id=parent_id), f'{prefix}{number}.')
+            for parent_id, prefix in level
+            for number in range(1, fanout + 1)
+        ]
+        db.session.add_all(category for category, _ in categories)
+        db.session.flush()
+        level = [(category.id, prefix) for category, prefix in categories]
+    db.session.commit()
+    return [category_id for category_id, _ in level]
+
+def create_skills(leaves, count):
+    from models import db, Skill
+
+    skills = [Skill(name=f'Skill {number}', category_id=leaves[number % len(leaves)]) for number in range(1, count + 1)]
+    db.session.add_all(skills)
+    db.session.commit()
+    return [skill.id for skill in skills]
+
+def create_users(count, rng):
+    from models import db, User
+
+    password = generate_password_hash(PASSWORD)
+    rows = [{
+        'email': ADMIN_EMAIL, 'name': 'Admin', 'surname': 'Bench', 'password': password,
+        'role': 'admin', 'senior': True, 'accepted_privacy': True,
+    }]
+    for number in range(1, count + 1):
+        rows.append({
+            'email': f'user{number}@bench.local',
+            'name': f'Name{number}',
+            'surname': f'Surname{rng.randrange(count)}',
+            'password': password,
+            'role': 'user',
+            'senior': rng.random() < 0.2,
+            'accepted_privacy': True,
+        })
+
+    ids = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        statement = insert(User).returning(User.id, sort_by_parameter_order=True)
+        ids += db.session.execute(statement, rows[start:start + BATCH_SIZE]).scalars().all()
+    db.session.commit()
+    return ids[1:]
+
+def create_user_skills(user_ids, skill_ids, total, rng):
+    from models import db, UserSkill
+
+    # popular skills are held by many users, like in a real organization
+    weights = [1 / rank for rank in range(1, len(skill_ids) + 1)]
+    per_user = max(1, min(len(skill_ids), total // max(1, len(user_ids))))
+    rows = []
+    created = 0
+    for user_id in user_ids:
+        chosen = set()
+        while len(chosen) < per_user:
+            chosen.update(rng.choices(skill_ids, weights, k=per_user - len(chosen)))
+        rows += [{'user_id': user_id, 'skill_id': skill_id, 'level': rng.randint(1, 5)} for skill_id in chosen]
+        if len(rows) >= BATCH_SIZE:
+            db.session.execute(insert(UserSkill), rows)
+            created += len(rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(UserSkill), rows)
+        created += len(rows)
+    db.session.commit()
+    return created
+
+def seed(args):
+    from app import create_app
+    from audit import audit_writer
+    from migrations import init_db
+    from models import db, User, USER_SKILLS, USERS, bump_version
+
+    app = create_app()
+    rng = random.Random(args.seed)
+    with app.app_context():
+        init_db()
+        if User.query.first() is not None:
+            sys.exit(f'{app.config["SQLALCHEMY_DATABASE_URI"]} is not empty, refusing to seed it')
+
+        started = time.perf_counter()
+        leaves = create_categories(args.depth, args.fanout)
+        skill_ids = create_skills(leaves, args.skills)
+        user_ids = create_users(args.users, rng)
+        user_skills = create_user_skills(user_ids, skill_ids, args.user_skills, rng)
+
+        # bulk inserts skip the listeners that keep in-process caches coherent
+        bump_version(db.session.connection(), USER_SKILLS)
+        bump_version(db.session.connection(), USERS)
+        db.session.commit()
+        audit_writer.flush()
+
+        print(f'{len(leaves)} leaf categories, {len(skill_ids)} skills, {len(user_ids)} users, '
+              f'{user_skills} user skills in {time.perf_counter() - started:.1f}s '
+              f'into {app.config["SQLALCHEMY_DATABASE_URI"]}')
+
+if __name__ == '__main__':
+    seed(parse_args())
@@ -0,0 +1,108 @@
+"""Measure how long a fresh worker takes to import the app, create it and serve its first requests.
+
+    SKILLZ_DATABASE_URI=sqlite:///bench.db python bench/startup.py --output bench/results/startup.json
+    SKILLZ_DATABASE_URI=sqlite:///bench.db python bench/startup.py --only index --only skills --runs 10
+
+Every run is a new Python process, like a freshly forked gunicorn worker
+without --preload: it imports app.py, calls create_app() and sends one route
+the same request twice through Flask's test client. The first request pays for
+what is created lazily (connections, caches, indexes, numpy), the second one
+shows the warm cost. The report has the median of --runs processes per route,
+and whether numpy was already imported once the app was created. Run it
+against a database built by bench/seed.py; the set_skill scenario changes
+levels in it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='processes per scenario')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', action='append', default=[], help='run only these scenarios')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def child(name, seed):
+    # nothing but the standard library is imported before the clock starts
+    started = time.perf_counter()
+    import app as application
+    imported = time.perf_counter()
+    app = application.create_app()
+    created = time.perf_counter()
+    numpy_loaded = 'numpy' in sys.modules
+
+    import random
+    from run import Sample, login, request, scenarios
+    from audit import audit_writer
+    from models import db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        sample = Sample(random.Random(seed))
+        db.session.remove()
+    role, make_request = scenarios(sample)[name]
+    client = app.test_client()
+    login(client, sample.user(role))
+
+    requests = []
+    for _ in range(2):
+        method, url, body = make_request()
+        request_started = time.perf_counter()
+        request(client, method, url, body)
+        requests.append(time.perf_counter() - request_started)
+    audit_writer.flush()
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': requests[0] * 1000,
+        'second_request_ms': requests[1] * 1000,
+        'numpy_at_startup': numpy_loaded,
+    }))
+
+def measure(name, args):
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, __file__, '--child', name, '--seed', str(args.seed)],
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = {
+        metric: round(statistics.median(run[metric] for run in runs), 2)
+        for metric in ('import_ms', 'create_app_ms', 'first_request_ms', 'second_request_ms')
+    }
+    result['numpy_at_startup'] = any(run['numpy_at_startup'] for run in runs)
+    return result
+
+def run(args):
+    from run import scenarios
+
+    results = {}
+    for name in scenarios(None):
+        if args.only and name not in args.only:
+            continue
+        results[name] = result = measure(name, args)
+        print(f'{name:15} import {result["import_ms"]:8.1f} ms  create_app {result["create_app_ms"]:6.1f} ms  '
+              f'first request {result["first_request_ms"]:8.1f} ms  second {result["second_request_ms"]:7.1f} ms')
+    return {'settings': {'runs': args.runs, 'seed': args.seed}, 'scenarios': results}
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.child:
+        child(args.child, args.seed)
+    else:
+        report = run(args)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w') as stream:
+                json.dump(report, stream, indent=2)
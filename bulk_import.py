@@ -0,0 +1,302 @@
+import csv
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+from werkzeug.security import generate_password_hash
+from forms import CreateUserForm
+from models import db, Category, Skill, User, UserSkill, LEVELS, USER_SKILLS, USERS, bump_version, bump_versions, skill_key, model_audit_log
+from tree_cache import tree_cache
+
+# Bulk import of users, optionally with their skill levels and any missing
+# categories and skills. Rows are validated with the CreateUserForm rules,
+# passwords are hashed across a process pool and users are inserted in batched
+# transactions. Invalid rows are reported and skipped.
+#
+# CSV columns: name, surname, email, password, role, senior, skills
+# where skills looks like "Tech / Languages / Python=4; Soft skills / English=3"
+# (category path / skill name = level). JSONL rows use the same keys; their
+# skills may also be a list of {"category": ..., "skill": ..., "level": ...}.
+
+BATCH_SIZE = 500
+HASH_CHUNK_SIZE = 32
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+class ImportRow:
+    def __init__(self, line, data):
+        self.line = line
+        self.email = str(data.get('email') or '').strip()
+        self.data = data
+        self.user = None
+        self.password = None
+        self.senior = str(data.get('senior') or '').strip().lower() in TRUE_VALUES
+        self.skills = [] # (category path, skill name, level)
+        self.errors = []
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.categories_created = 0
+        self.skills_created = 0
+        self.errors = [] # (line, email, messages)
+        self.dry_run = False
+
+def read_rows(stream, filename):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    if filename.lower().endswith('.jsonl'):
+        for line, value in enumerate(text, start=1):
+            if not value.strip():
+                continue
+            try:
+                data = json.loads(value)
+            except ValueError as error:
+                data = {'_error': f'Invalid JSON: {error}'}
+            yield line, data if isinstance(data, dict) else {'_error': 'Expected a JSON object'}
+    else:
+        # line 1 is the header
+        for line, data in enumerate(csv.DictReader(text), start=2):
+            if any(str(value or '').strip() for value in data.values()):
+                yield line, data
+
+def parse_skills(value):
+    if not value:
+        return [], []
+    if isinstance(value, list):
+        items = [(item.get('category', ''), item.get('skill', ''), item.get('level'))
+                 for item in value if isinstance(item, dict)]
+    else:
+        items = []
+        for spec in str(value).split(';'):
+            if not spec.strip():
+                continue
+            name, _, level = spec.rpartition('=')
+            path, _, name = name.rpartition(' / ')
+            items.append((path, name, level))
+
+    skills = []
+    errors = []
+    for path, name, level in items:
+        path = ' / '.join(segment.strip() for segment in str(path).split(' / ')).strip()
+        name = str(name).strip()
+        try:
+            level = int(level)
+        except (TypeError, ValueError):
+            level = None
+        if not name or level not in LEVELS:
+            errors.append(f'Invalid skill "{path} / {name}={level}", expected category path / skill = level 1-5')
+        else:
+            skills.append((path, name, level))
+    return skills, errors
+
+def validate_rows(rows):
+    emails = set()
+    validated = []
+
+    for line, data in rows:
+        row = ImportRow(line, data)
+        validated.append(row)
+        if '_error' in data:
+            row.errors.append(data['_error'])
+            continue
+
+        formdata = MultiDict({
+            'name': str(data.get('name') or ''),
+            'surname': str(data.get('surname') or ''),
+            'email': row.email,
+            'password': str(data.get('password') or ''),
+            'confirm_password': str(data.get('password') or ''),
+            'role': str(data.get('role') or 'user'),
+        })
+        form = CreateUserForm(formdata=formdata, meta={'csrf': False})
+        if not form.validate():
+            row.errors += [f'{getattr(form, field).label.text}: {error}'
+                           for field, errors in form.errors.items() for error in errors]
+
+        if row.email.lower() in emails:
+            row.errors.append('Duplicate email in file')
+        emails.add(row.email.lower())
+
+        row.skills, errors = parse_skills(data.get('skills'))
+        row.errors += errors
+
+        row.user = {
+            'name': form.name.data,
+            'surname': form.surname.data,
+            'email': row.email,
+            'role': form.role.data,
+            'senior': row.senior,
+        }
+        row.password = form.password.data
+
+    existing = set()
+    valid_emails = [row.email for row in validated if not row.errors]
+    for start in range(0, len(valid_emails), BATCH_SIZE):
+        chunk = valid_emails[start:start + BATCH_SIZE]
+        existing.update(db.session.execute(select(User.email).where(User.email.in_(chunk))).scalars())
+    for row in validated:
+        if row.email in existing:
+            row.errors.append('A user with this email already exists')
+
+    return validated
+
+class TaxonomyPlan:
+    """Skills referenced by the import, resolved against the current taxonomy."""
+
+    def __init__(self, create):
+        tree = tree_cache.get()
+        self.create = create
+        self.categories = {category.path: category for category in tree.categories.values()}
+        self.category_names = {category.name: category.path for category in tree.categories.values()}
+        self.skills = {skill.name: skill for skill in tree.skills.values()}
+        self.tree = tree
+        self.new_categories = {} # path -> parent path
+        self.new_skills = {} # name -> category path
+        self.parents = set() # paths of new or existing categories getting children
+        self.leaves = set() # paths of new or existing categories getting skills
+
+    def resolve(self, path, name):
+        skill = self.skills.get(name)
+        if skill is not None:
+            actual = self.tree.categories[skill.category_id].path if skill.category_id in self.tree.categories else ''
+            if path and path != actual:
+                return f'Skill "{name}" already exists in "{actual}"'
+            return None
+        if name in self.new_skills:
+            if path and path != self.new_skills[name]:
+                return f'Skill "{name}" is listed under both "{self.new_skills[name]}" and "{path}"'
+            return None
+        if not self.create:
+            return f'Unknown skill "{name}"'
+        if not path:
+            return f'New skill "{name}" needs a category path'
+
+        error = self._plan_category(path)
+        if error:
+            return error
+        category = self.categories.get(path)
+        if (category is not None and category.children) or path in self.parents:
+            return f'Category "{path}" has subcategories, skills can only be added to leaf categories'
+        self.new_skills[name] = path
+        self.leaves.add(path)
+        return None
+
+    def _plan_category(self, path):
+        segments = [segment.strip() for segment in path.split(' / ')]
+        parent = None
+        for depth, name in enumerate(segments, start=1):
+            current = ' / '.join(segments[:depth])
+            if current in self.categories or current in self.new_categories:
+                parent = current
+                continue
+            if not name:
+                return f'Invalid category path "{path}"'
+            if name in self.category_names:
+                return f'Category "{name}" already exists as "{self.category_names[name]}"'
+            if parent is not None:
+                existing = self.categories.get(parent)
+                if (existing is not None and existing.skills) or parent in self.leaves:
+                    return f'Category "{parent}" has skills, subcategories can only be added to categories without skills'
+                self.parents.add(parent)
+            self.new_categories[current] = parent
+            self.category_names[name] = current
+            parent = current
+        return None
+
+    def apply(self):
+        ids = {path: category.id for path, category in self.categories.items()}
+        for path, parent in sorted(self.new_categories.items(), key=lambda item: item[0].count(' / ')):
+            category = Category(name=path.rpartition(' / ')[2] if parent else path, parent_id=ids.get(parent))
+            db.session.add(category)
+            db.session.flush()
+            ids[path] = category.id
+
+        new_skills = [Skill(name=name, category_id=ids[path]) for name, path in self.new_skills.items()]
+        db.session.add_all(new_skills)
+        db.session.commit()
+
+        skill_ids = {name: skill.id for name, skill in self.skills.items()}
+        skill_ids.update((skill.name, skill.id) for skill in new_skills)
+        return skill_ids
+
+def hash_passwords(passwords, workers=None):
+    # spawn: forking a worker that runs background threads is unsafe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(generate_password_hash, passwords, chunksize=HASH_CHUNK_SIZE))
+
+def insert_batch(rows, skill_ids):
+    statement = insert(User).returning(User.id, User.email, sort_by_parameter_order=True)
+    users = db.session.execute(statement, [
+        dict(row.user, password=row.password_hash, accepted_privacy=False) for row in rows
+    ]).all()
+
+    user_skills = [
+        {'user_id': user_id, 'skill_id': skill_ids[name], 'level': level}
+        for (user_id, _), row in zip(users, rows)
+        for name, level in {name: level for _, name, level in row.skills}.items()
+    ]
+    if user_skills:
+        db.session.execute(insert(UserSkill), user_skills)
+        bump_version(db.session.connection(), USER_SKILLS)
+        bump_versions(db.session.connection(), [skill_key(item['skill_id']) for item in user_skills])
+    bump_version(db.session.connection(), USERS)
+
+    # bulk inserts skip the per-user after_insert listener, log the batch instead
+    model_audit_log(
+        action='import users',
+        data={
+            'count': len(users),
+            'skills': len(user_skills),
+            'emails': [email for _, email in users]
+        })
+    db.session.commit()
+
+def import_users(stream, filename, create_taxonomy=False, dry_run=False, workers=None):
+    result = ImportResult()
+    result.dry_run = dry_run
+
+    rows = validate_rows(read_rows(stream, filename))
+    plan = TaxonomyPlan(create_taxonomy)
+    for row in rows:
+        for path, name, _ in row.skills:
+            error = plan.resolve(path, name)
+            if error:
+                row.errors.append(error)
+
+    valid = [row for row in rows if not row.errors]
+    result.errors = [(row.line, row.email, row.errors) for row in rows if row.errors]
+    if dry_run or not valid:
+        return result
+
+    # only create taxonomy that valid rows actually use
+    used = {name for row in valid for _, name, _ in row.skills}
+    plan.new_skills = {name: path for name, path in plan.new_skills.items() if name in used}
+    used_paths = set()
+    for path in plan.new_skills.values():
+        while path:
+            used_paths.add(path)
+            path = plan.new_categories.get(path)
+    plan.new_categories = {path: parent for path, parent in plan.new_categories.items() if path in used_paths}
+
+    skill_ids = plan.apply()
+    result.categories_created = len(plan.new_categories)
+    result.skills_created = len(plan.new_skills)
+
+    hashes = hash_passwords([row.password for row in valid], workers)
+    for row, password_hash in zip(valid, hashes):
+        row.password_hash = password_hash
+
+    for start in range(0, len(valid), BATCH_SIZE):
+        batch = valid[start:start + BATCH_SIZE]
+        try:
+            insert_batch(batch, skill_ids)
+            result.created += len(batch)
+        except IntegrityError as error:
+            db.session.rollback()
+            result.errors += [(row.line, row.email, [f'Not imported: {error.orig}']) for row in batch]
+
+    result.errors.sort(key=lambda error: error[0])
+    return result
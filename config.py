@@ -1 +1,47 @@
-SECRET_KEY = 'Spread_Love Not Hate'
\ No newline at end of file
+import os
+
+SECRET_KEY = 'Spread_Love Not Hate'
+
+# relative sqlite paths live in the instance folder
+SQLALCHEMY_DATABASE_URI = os.environ.get('SKILLZ_DATABASE_URI', 'sqlite:///skillz.db')
+
+# SQLite engine profile (see database.py): WAL journal, fsync at checkpoints
+# only, wait up to SQLITE_BUSY_TIMEOUT ms for a lock, a transaction takes the
+# write lock at its first write. Writes of a worker go through a pool of
+# SQLITE_WRITE_POOL_SIZE connections, GET requests of read-only views through
+# a separate pool of SQLITE_READ_POOL_SIZE query_only connections.
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_IMMEDIATE_WRITES = True
+SQLITE_WRITE_POOL_SIZE = 2
+SQLITE_READ_POOL_SIZE = 8
+SQLITE_POOL_TIMEOUT = 30
+
+# audit log writer: records are buffered and written in batches of at most
+# AUDIT_BATCH_SIZE, at most AUDIT_FLUSH_INTERVAL seconds after they are logged.
+# Set AUDIT_SYNC to write every record before the request returns.
+AUDIT_SYNC = False
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 0.5
+AUDIT_QUEUE_SIZE = 10000
+
+# audit entries older than AUDIT_RETENTION_DAYS are moved to monthly gzip JSONL
+# segments in AUDIT_ARCHIVE_DIR (instance/audit by default) by `flask archive-audit`
+AUDIT_RETENTION_DAYS = 365
+
+# rendered HTML fragments (e.g. the category tree) kept in memory per worker
+FRAGMENT_CACHE_MAX_ENTRIES = 64
+FRAGMENT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# add a Server-Timing header (SQL, template and total time) to every response
+METRICS_SERVER_TIMING = False
+
+# sampling profiler, endpoints and rates are set by admins on /profiler;
+# profiles are kept in instance/profiles, PROFILER_MAX_PROFILES per endpoint
+PROFILER_CHECK_INTERVAL = 5
+PROFILER_MAX_PROFILES = 20
+
+# skill level history: every level change is logged; `flask compact-history`,
+# run periodically (e.g. daily), folds the log into snapshots in HISTORY_DIR
+# (instance/history by default) that as-of and trend queries start from
@@ -0,0 +1,90 @@
+from functools import wraps
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# SQLite engine profile for several workers sharing one database file.
+#
+# Two engines point at the same file. The default one is the writer, a small
+# pool of SQLITE_WRITE_POOL_SIZE connections (a request and the audit writer
+# thread) whose transactions begin with BEGIN IMMEDIATE, issued by the sqlite3
+# module before the first write of a transaction. The write lock is taken at
+# that point and waited for up to SQLITE_BUSY_TIMEOUT, so writers queue up one
+# at a time instead of failing with "database is locked" when they find
+# another worker in the middle of a write.
+#
+# The "read" engine has a larger pool of query_only connections. Views
+# decorated with read_only run their GET requests on it, in WAL mode readers
+# never wait for the writer nor block it. The journal mode is stored in the
+# database file, the other settings are applied to every new connection.
+
+READ_BIND = 'read'
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # ORM flushes always go to the writer, a read-only view that writes fails loudly on query_only
+        if bind is None and not self._flushing and has_app_context() and g.get('read_only'):
+            return self._db.engines[READ_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_only(view):
+    """Run the GET and HEAD requests of a view on the read pool."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+def _end_read_only(exception):
+    # g outlives the request when the caller pushed the app context (scripts, test clients)
+    g.pop('read_only', None)
+
+def _set_pragmas(dbapi_connection, config, query_only):
+    cursor = dbapi_connection.cursor()
+    if config['SQLITE_JOURNAL_MODE']:
+        cursor.execute(f'PRAGMA journal_mode = {config["SQLITE_JOURNAL_MODE"]}')
+    cursor.execute(f'PRAGMA synchronous = {config["SQLITE_SYNCHRONOUS"]}')
+    cursor.execute(f'PRAGMA busy_timeout = {int(config["SQLITE_BUSY_TIMEOUT"])}')
+    if query_only:
+        cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+def configure_writer(engine, config):
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, config, query_only=False)
+        if config['SQLITE_IMMEDIATE_WRITES']:
+            # reads before the first write still run outside a transaction and take no lock
+            dbapi_connection.isolation_level = 'IMMEDIATE'
+
+def configure_reader(engine, config):
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, config, query_only=True)
+
+def init_app(app, db):
+    app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+    app.config.setdefault('SQLITE_IMMEDIATE_WRITES', True)
+    app.config.setdefault('SQLITE_WRITE_POOL_SIZE', 2)
+    app.config.setdefault('SQLITE_READ_POOL_SIZE', 8)
+    app.config.setdefault('SQLITE_POOL_TIMEOUT', 30)
+
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engine_options.setdefault('pool_size', app.config['SQLITE_WRITE_POOL_SIZE'])
+    engine_options.setdefault('max_overflow', 0)
+    engine_options.setdefault('pool_timeout', app.config['SQLITE_POOL_TIMEOUT'])
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).setdefault(READ_BIND, {
+        'url': app.config['SQLALCHEMY_DATABASE_URI'],
+        'pool_size': app.config['SQLITE_READ_POOL_SIZE'],
+        'max_overflow': 0,
+        'pool_timeout': app.config['SQLITE_POOL_TIMEOUT'],
+    })
+
+    db.init_app(app)
+    app.teardown_request(_end_read_only)
+    with app.app_context():
+        configure_writer(db.engines[None], app.config)
+        configure_reader(db.engines[READ_BIND], app.config)
@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+import zlib
+from sqlalchemy import select
+from models import db, Category, Skill, User, UserSkill
+
+# Streaming export of the user x skill matrix. Rows are read with yield_per and
+# encoded into ~64KB chunks, so memory stays flat however many users and skills
+# there are.
+
+YIELD_PER = 1000
+CHUNK_SIZE = 64 * 1024
+
+USER_COLUMNS = ['user_id', 'email', 'name', 'surname', 'senior']
+LONG_COLUMNS = USER_COLUMNS + ['skill_id', 'category', 'skill', 'level']
+
+def skill_label(skill, categories):
+    category = categories.get(skill.category_id)
+    return f'{category.path} / {skill.name}' if category else skill.name
+
+def ordered_skills(tree):
+    # matrix columns follow the category tree
+    skills = []
+
+    def walk(categories):
+        for category in categories:
+            skills.extend(category.skills)
+            walk(category.children)
+
+    walk(tree.roots)
+    return skills
+
+def wide_records(tree):
+    skills = ordered_skills(tree)
+    labels = [skill_label(skill, tree.categories) for skill in skills]
+    positions = {skill.id: position for position, skill in enumerate(skills)}
+
+    statement = select(User.id, User.email, User.name, User.surname, User.senior, UserSkill.skill_id, UserSkill.level) \
+        .outerjoin(UserSkill, UserSkill.user_id == User.id) \
+        .order_by(User.id) \
+        .execution_options(yield_per=YIELD_PER)
+
+    yield labels
+    user = None
+    levels = None
+    for user_id, email, name, surname, senior, skill_id, level in db.session.execute(statement):
+        if user is None or user[0] != user_id:
+            if user is not None:
+                yield user, levels
+            user = [user_id, email, name, surname, senior]
+            levels = {}
+        if skill_id in positions and level:
+            levels[positions[skill_id]] = level
+    if user is not None:
+        yield user, levels
+
+def long_records():
+    statement = select(
+        User.id, User.email, User.name, User.surname, User.senior,
+        Skill.id, Category.path, Skill.name, UserSkill.level
+    ) \
+        .join(UserSkill, UserSkill.user_id == User.id) \
+        .join(Skill, Skill.id == UserSkill.skill_id) \
+        .outerjoin(Category, Category.id == Skill.category_id) \
+        .order_by(UserSkill.user_id, UserSkill.skill_id) \
+        .execution_options(yield_per=YIELD_PER)
+
+    for row in db.session.execute(statement):
+        yield list(row)
+
+def buffered(write_rows):
+    # write_rows(buffer) yields after each row; collect them into large chunks
+    buffer = io.StringIO()
+    for _ in write_rows(buffer):
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def wide_csv(tree):
+    def write_rows(buffer):
+        writer = csv.writer(buffer)
+        records = wide_records(tree)
+        labels = next(records)
+        writer.writerow(USER_COLUMNS + labels)
+        yield
+        empty = [0] * len(labels)
+        for user, levels in records:
+            row = empty.copy()
+            for position, level in levels.items():
+                row[position] = level
+            writer.writerow(user + row)
+            yield
+    return buffered(write_rows)
+
+def wide_jsonl(tree):
+    def write_rows(buffer):
+        records = wide_records(tree)
+        labels = next(records)
+        for user, levels in records:
+            record = dict(zip(USER_COLUMNS, user))
+            record['skills'] = {labels[position]: level for position, level in sorted(levels.items())}
+            buffer.write(json.dumps(record) + '\n')
+            yield
+    return buffered(write_rows)
+
+def long_csv():
+    def write_rows(buffer):
+        writer = csv.writer(buffer)
+        writer.writerow(LONG_COLUMNS)
+        yield
+        for row in long_records():
+            writer.writerow(row)
+            yield
+    return buffered(write_rows)
+
+def long_jsonl():
+    def write_rows(buffer):
+        for row in long_records():
+            buffer.write(json.dumps(dict(zip(LONG_COLUMNS, row))) + '\n')
+            yield
+    return buffered(write_rows)
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+EXPORTS = {
+    ('wide', 'csv'): wide_csv,
+    ('wide', 'jsonl'): wide_jsonl,
+    ('long', 'csv'): lambda tree: long_csv(),
+    ('long', 'jsonl'): lambda tree: long_jsonl(),
+}
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
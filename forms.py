@@ -1,10 +1,18 @@
+from flask import current_app, flash
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from wtforms import BooleanField, HiddenField, SelectField, StringField, PasswordField, SubmitField, TextAreaField, ValidationError
 from wtforms.validators import DataRequired, EqualTo
 from models import Category, User
 from wtforms.validators import Email
 from wtforms.validators import NumberRange
-from wtforms.fields import DecimalField
+from wtforms.fields import DateField, DecimalField, IntegerField
+from wtforms.validators import Optional
+
+def flash_errors(form):
+    for field, errors in form.errors.items():
+        for error in errors:
+            flash(f'Error in field "{getattr(form, field).label.text}": {error}', 'error')
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -51,4 +59,65 @@ class RemovePrivacyForm(FlaskForm):
     submit = SubmitField('Conferma')
 
 class ToggleSeniorForm(FlaskForm):
-    user_id = HiddenField('User ID', validators=[DataRequired()])
\ No newline at end of file
+    user_id = HiddenField('User ID', validators=[DataRequired()])
+
+class ImportUsersForm(FlaskForm):
+    file = FileField('CSV or JSONL file', validators=[FileRequired(), FileAllowed(['csv', 'jsonl'], 'Only .csv and .jsonl files')])
+    create_taxonomy = BooleanField('Create missing categories and skills')
+    dry_run = BooleanField('Only validate, do not import')
+    submit = SubmitField('Import')
+
+YES_NO_ANY = [('', 'Any'), ('yes', 'Yes'), ('no', 'No')]
+
+class UserFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    q = StringField('Name or email starts with')
+    role = SelectField('Role', choices=[('', 'Any'), ('user', 'User'), ('admin', 'Admin')], default='')
+    senior = SelectField('Senior', choices=YES_NO_ANY, default='')
+    accepted_privacy = SelectField('Privacy Accepted', choices=YES_NO_ANY, default='')
+    last_login_from = DateField('Last login from', validators=[Optional()])
+    last_login_to = DateField('Last login to', validators=[Optional()])
+
+class AuditFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    email = StringField('Email')
+    action = StringField('Action')
+    date_from = DateField('From', validators=[Optional()])
+    date_to = DateField('To', validators=[Optional()])
+    archived = BooleanField('Search archived entries')
+
+class HistoryFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    at = DateField('As of', validators=[Optional()])
+    user_id = IntegerField('User', validators=[Optional()])
+    skill_id = IntegerField('Skill', validators=[Optional()])
+    date_from = DateField('From', validators=[Optional()])
+    date_to = DateField('To', validators=[Optional()])
+    points = IntegerField('Points', validators=[Optional(), NumberRange(min=1, max=366)])
+
+class ProfilerForm(FlaskForm):
+    endpoints = TextAreaField('Profiled endpoints, one "endpoint rate" per line (e.g. "skills.search 0.1")')
+    submit = SubmitField('Save')
+
+    def validate_endpoints(self, field):
+        rates = {}
+        for line in (field.data or '').splitlines():
+            if not line.strip():
+                continue
+            endpoint, _, rate = line.strip().partition(' ')
+            if endpoint not in current_app.view_functions:
+                raise ValidationError(f'Unknown endpoint "{endpoint}"')
+            try:
+                rate = float(rate.strip() or 1)
+            except ValueError:
+                raise ValidationError(f'Invalid rate for "{endpoint}"')
+            if not 0 < rate <= 1:
+                raise ValidationError(f'The rate of "{endpoint}" must be between 0 and 1')
+            rates[endpoint] = rate
+        self.rates = rates
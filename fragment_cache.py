@@ -0,0 +1,82 @@
+import re
+import threading
+from collections import OrderedDict
+from markupsafe import Markup, escape
+
+# Cache of rendered HTML fragments, e.g. the category tree, keyed by whatever
+# the fragment depends on (usually the taxonomy version). Per-request values
+# are left out of the cached HTML as overlay placeholders and filled in with
+# apply_overlays. Least recently used entries are evicted once there are more
+# than max_entries or their total size exceeds max_bytes.
+
+OVERLAY = re.compile(r'<!--overlay:(\w+):(\w*)-->')
+
+def overlay(name, argument=''):
+    """Placeholder for a per-request value, to be used in cached templates."""
+    return Markup(f'<!--overlay:{name}:{argument}-->')
+
+def apply_overlays(html, **overlays):
+    # overlays maps a placeholder name to a function of its argument
+    return Markup(OVERLAY.sub(lambda match: escape(overlays[match.group(1)](match.group(2))), html))
+
+class FragmentCache:
+    def __init__(self, app=None):
+        self.max_entries = 64
+        self.max_bytes = 8 * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_MAX_ENTRIES', self.max_entries)
+        app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', self.max_bytes)
+        self.max_entries = app.config['FRAGMENT_CACHE_MAX_ENTRIES']
+        self.max_bytes = app.config['FRAGMENT_CACHE_MAX_BYTES']
+        app.jinja_env.globals['overlay'] = overlay
+
+    def get(self, key, render):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # rendered outside the lock; two requests may render the same fragment
+        html = str(render())
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return html
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (html, size)
+                self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,251 @@
+import fcntl
+import os
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+from sqlalchemy import delete, select
+from analytics import fetch_array
+from models import db, HistoryPurge, SkillLevelEvent, LEVELS
+
+# Skill level history. Every change of a user_skill row is appended to
+# skill_level_event by SQLite triggers. `flask compact-history`, run
+# periodically, folds the events into a dated snapshot of the whole
+# (user, skill) -> level matrix in HISTORY_DIR (instance/history), named
+# <time of the last event>-<last event id>.npz. In a snapshot the rows are
+# sorted by (user, skill) and the ids are delta encoded, so the compressed
+# arrays stay small; a per-skill level histogram is stored next to them.
+#
+# The levels as of a date are the latest snapshot taken before it plus the
+# events that follow it up to that date, so a query only replays the events
+# since the last compaction. Event ids follow commit order, every event of a
+# snapshot happened before the events after it.
+#
+# Revoking consent deletes the user's events and records a HistoryPurge row;
+# the compaction removes those users from every snapshot. Snapshots are only
+# written under the lock file of HISTORY_DIR, one compaction at a time across
+# workers and cron runs. Until the purge is done, levels_as_of leaves the
+# revoked users out; skill_trend counts come from the snapshot histograms and
+# still include them.
+
+SNAPSHOT_SUFFIX = '.npz'
+LOCK_FILE = '.lock'
+USER_SHIFT = 32 # a (user, skill) pair is encoded as user_id << 32 | skill_id
+
+Snapshot = namedtuple('Snapshot', 'as_of last_event_id path')
+
+def encode(user_ids, skill_ids):
+    return (np.asarray(user_ids, dtype=np.int64) << USER_SHIFT) | np.asarray(skill_ids, dtype=np.int64)
+
+def decode(keys):
+    return keys >> USER_SHIFT, keys & ((1 << USER_SHIFT) - 1)
+
+def snapshots(directory):
+    """Snapshots in HISTORY_DIR, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(SNAPSHOT_SUFFIX):
+            continue
+        try:
+            day, clock, micro, last_event_id = name[:-len(SNAPSHOT_SUFFIX)].split('-')
+            as_of = datetime.strptime(f'{day}-{clock}-{micro}', '%Y%m%d-%H%M%S-%f')
+            entries.append(Snapshot(as_of, int(last_event_id), os.path.join(directory, name)))
+        except ValueError:
+            continue
+    entries.sort(key=lambda snapshot: snapshot.last_event_id)
+    return entries
+
+def snapshot_before(directory, at):
+    """The latest snapshot whose events all happened at or before at, None if there is none."""
+    candidates = [snapshot for snapshot in snapshots(directory) if snapshot.as_of <= at]
+    return candidates[-1] if candidates else None
+
+def histogram(keys, levels):
+    skill_ids, positions = np.unique(decode(keys)[1], return_inverse=True)
+    counts = np.zeros((len(skill_ids), len(LEVELS)), dtype=np.int32)
+    np.add.at(counts, (positions, levels.astype(np.int64) - 1), 1)
+    return skill_ids, counts
+
+def write_snapshot(path, keys, levels):
+    user_ids, skill_ids = decode(keys)
+    histogram_skills, histogram_counts = histogram(keys, levels)
+    # written aside and renamed, a reader never sees half a snapshot
+    descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor, 'wb') as stream:
+            np.savez_compressed(
+                stream,
+                users=np.diff(user_ids, prepend=0).astype(np.int32),
+                skills=np.diff(skill_ids, prepend=0).astype(np.int32),
+                levels=levels.astype(np.int8),
+                histogram_skills=histogram_skills,
+                histogram=histogram_counts,
+            )
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def read_snapshot(snapshot):
+    """Sorted (user, skill) keys and their levels, empty when there is no snapshot."""
+    if snapshot is None:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+    with np.load(snapshot.path) as data:
+        user_ids = np.cumsum(data['users'], dtype=np.int64)
+        skill_ids = np.cumsum(data['skills'], dtype=np.int64)
+        return encode(user_ids, skill_ids), data['levels']
+
+def read_histogram(snapshot, skill_id):
+    if snapshot is None:
+        return np.zeros(len(LEVELS), dtype=np.int64)
+    with np.load(snapshot.path) as data:
+        skill_ids = data['histogram_skills']
+        position = np.searchsorted(skill_ids, skill_id)
+        if position < len(skill_ids) and skill_ids[position] == skill_id:
+            return data['histogram'][position].astype(np.int64)
+    return np.zeros(len(LEVELS), dtype=np.int64)
+
+def apply_events(keys, levels, event_keys, event_levels):
+    """Apply events, in id order, to the sorted keys and levels; pairs set to level 0 are dropped."""
+    if not len(event_keys):
+        return keys, levels
+    # the last event of every pair wins
+    changed, last = np.unique(event_keys[::-1], return_index=True)
+    changed_levels = event_levels[::-1][last]
+
+    kept = ~np.isin(keys, changed)
+    keys = np.concatenate([keys[kept], changed])
+    levels = np.concatenate([levels[kept], changed_levels.astype(np.int8)])
+    order = np.argsort(keys, kind='stable')
+    keys, levels = keys[order], levels[order]
+    present = levels > 0
+    return keys[present], levels[present]
+
+def load_events(after_id, until_id=None, at=None, user_id=None, skill_id=None):
+    """Keys and levels of the events after after_id, in id order."""
+    query = select(SkillLevelEvent.user_id, SkillLevelEvent.skill_id, SkillLevelEvent.level).where(
+        SkillLevelEvent.id > after_id
+    )
+    if until_id is not None:
+        query = query.where(SkillLevelEvent.id <= until_id)
+    if at is not None:
+        query = query.where(SkillLevelEvent.timestamp <= at)
+    if user_id is not None:
+        query = query.where(SkillLevelEvent.user_id == user_id)
+    if skill_id is not None:
+        query = query.where(SkillLevelEvent.skill_id == skill_id)
+    rows = fetch_array(query.order_by(SkillLevelEvent.id), 3)
+    return encode(rows[:, 0], rows[:, 1]), rows[:, 2]
+
+@contextmanager
+def snapshot_lock(directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        yield
+
+def compact_history(directory):
+    """Purge the revoked users and write a snapshot with the events since the latest one.
+
+    Returns the snapshot (None without new events), the number of events and the purged user ids.
+    """
+    with snapshot_lock(directory):
+        purged = purge_pending(directory)
+        existing = snapshots(directory)
+        latest = existing[-1] if existing else None
+        after_id = latest.last_event_id if latest else 0
+
+        last = db.session.execute(
+            select(SkillLevelEvent.id, SkillLevelEvent.timestamp).order_by(SkillLevelEvent.id.desc()).limit(1)
+        ).first()
+        if last is None or last.id <= after_id:
+            db.session.commit()
+            return None, 0, purged
+
+        keys, levels = read_snapshot(latest)
+        event_keys, event_levels = load_events(after_id, until_id=last.id)
+        # the events were read before any revocation committed from here on, which the
+        # second purge finds: the new snapshot may hold the levels of those users
+        db.session.commit()
+        keys, levels = apply_events(keys, levels, event_keys, event_levels)
+
+        snapshot = Snapshot(last.timestamp, last.id, os.path.join(
+            directory, f'{last.timestamp:%Y%m%d-%H%M%S-%f}-{last.id}{SNAPSHOT_SUFFIX}'
+        ))
+        write_snapshot(snapshot.path, keys, levels)
+        purged += purge_pending(directory)
+        return snapshot, len(event_keys), purged
+
+def levels_as_of(directory, at, user_id=None, skill_id=None):
+    """[(user_id, skill_id, level)] held at the given datetime, optionally of one user or skill."""
+    snapshot = snapshot_before(directory, at)
+    keys, levels = read_snapshot(snapshot)
+    user_ids, skill_ids = decode(keys)
+    selected = ~np.isin(user_ids, pending_purges())
+    if user_id is not None:
+        selected &= user_ids == user_id
+    if skill_id is not None:
+        selected &= skill_ids == skill_id
+
+    event_keys, event_levels = load_events(
+        snapshot.last_event_id if snapshot else 0, at=at, user_id=user_id, skill_id=skill_id
+    )
+    keys, levels = apply_events(keys[selected], levels[selected], event_keys, event_levels)
+    user_ids, skill_ids = decode(keys)
+    return list(zip(user_ids.tolist(), skill_ids.tolist(), levels.tolist()))
+
+def skill_trend(directory, skill_id, points):
+    """Number of holders of every level of a skill at each of the given datetimes, in order."""
+    bases = [snapshot_before(directory, at) for at in points]
+    after_id = min((snapshot.last_event_id if snapshot else 0) for snapshot in bases) if points else 0
+
+    # one query for the events of every point, on the (skill_id, id) index
+    rows = db.session.execute(
+        select(SkillLevelEvent.id, SkillLevelEvent.timestamp, SkillLevelEvent.level, SkillLevelEvent.previous_level)
+        .where(SkillLevelEvent.skill_id == skill_id, SkillLevelEvent.id > after_id,
+               SkillLevelEvent.timestamp <= max(points, default=datetime.min))
+        .order_by(SkillLevelEvent.id)
+    ).all()
+    ids = np.array([row.id for row in rows], dtype=np.int64)
+    timestamps = np.array([row.timestamp for row in rows], dtype='datetime64[us]')
+    added = np.array([row.level for row in rows], dtype=np.int64)
+    removed = np.array([row.previous_level for row in rows], dtype=np.int64)
+
+    histograms = {}
+    trend = []
+    for at, snapshot in zip(points, bases):
+        if snapshot not in histograms:
+            histograms[snapshot] = read_histogram(snapshot, skill_id)
+        counts = histograms[snapshot].copy()
+        tail = (ids > (snapshot.last_event_id if snapshot else 0)) & (timestamps <= np.datetime64(at, 'us'))
+        np.add.at(counts, added[tail & (added > 0)] - 1, 1)
+        np.add.at(counts, removed[tail & (removed > 0)] - 1, -1)
+        trend.append(counts.tolist())
+    return trend
+
+def pending_purges():
+    return db.session.execute(select(HistoryPurge.user_id)).scalars().all()
+
+def purge_pending(directory):
+    """Remove the users of the HistoryPurge rows from every snapshot, returns their ids.
+
+    Called under the snapshot lock; the rows are deleted once every snapshot is rewritten,
+    a purge that fails half way is done again by the next compaction.
+    """
+    user_ids = pending_purges()
+    db.session.commit()
+    if not user_ids:
+        return []
+    for snapshot in snapshots(directory):
+        keys, levels = read_snapshot(snapshot)
+        kept = ~np.isin(decode(keys)[0], user_ids)
+        if not kept.all():
+            write_snapshot(snapshot.path, keys[kept], levels[kept])
+    db.session.execute(delete(HistoryPurge).where(HistoryPurge.user_id.in_(user_ids)))
+    db.session.commit()
+    return user_ids
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+from functools import wraps
+from flask import current_app, make_response, request, session
+from sqlalchemy import select
+from models import db, DataVersion
+
+# Conditional GET for pages that only depend on some DataVersion counters and
+# on who is looking at them. The ETag is derived from those counters and the
+# session identity, so a revalidation costs one small query and a matching
+# request gets a 304 without running the view.
+
+def identity():
+    return [session.get('id'), session.get('email'), session.get('role'), session.get('accepted_privacy')]
+
+def conditional(*keys, forms=False, state=None):
+    """Add ETag and Last-Modified to a view and answer matching requests with 304.
+
+    keys are DataVersion keys, or functions of the view arguments returning one.
+    state is a function returning what else the page depends on, e.g. in-process
+    data rebuilt in the background; its JSON goes into the ETag. With forms, the
+    page embeds CSRF tokens: the ETag then also changes every half
+    WTF_CSRF_TIME_LIMIT so a revalidated page never carries an expired token.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # a pending flash message is rendered once, that page must not be reused
+            if request.method != 'GET' or '_flashes' in session:
+                return func(*args, **kwargs)
+
+            names = [key(**kwargs) if callable(key) else key for key in keys]
+            rows = db.session.execute(
+                select(DataVersion.key, DataVersion.version, DataVersion.updated_at)
+                .where(DataVersion.key.in_(names))
+            ).all()
+            versions = dict.fromkeys(names, 0)
+            times = []
+            for key, version, updated_at in rows:
+                versions[key] = version
+                if updated_at:
+                    times.append(updated_at.timestamp())
+            if session.get('logged_in_at'):
+                times.append(session['logged_in_at'])
+
+            period = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+            bucket = None
+            if forms and period:
+                bucket = int(time.time() // (period / 2))
+                times.append(bucket * period / 2)
+
+            extra = state() if state else None
+            etag = hashlib.sha1(
+                json.dumps([sorted(versions.items()), identity(), bucket, extra], default=str, sort_keys=True).encode('utf-8')
+            ).hexdigest()
+            # only trust Last-Modified when it can't predate the current login
+            last_modified = datetime.fromtimestamp(max(times)) if times and session.get('logged_in_at') else None
+
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            elif not request.if_none_match and last_modified and request.if_modified_since \
+                    and int(last_modified.timestamp()) <= request.if_modified_since.timestamp():
+                response = make_response('', 304)
+            else:
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified.astimezone()
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,152 @@
+import bisect
+import threading
+import time
+from flask import g, has_request_context, before_render_template, template_rendered, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-route request metrics: latency, number of SQL queries, time spent in SQL
+# and in Jinja. Queries are counted with engine events, templates with Flask's
+# template signals. Values are kept per worker process and exposed in the
+# Prometheus text format; with METRICS_SERVER_TIMING each response also gets a
+# Server-Timing header with its own numbers.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels)
+    return '{' + pairs + '}'
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {} # labels, a tuple of (name, value) pairs -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        position = bisect.bisect_left(self.buckets, value)
+        if position < len(self.buckets):
+            series[position] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(labels + (("le", "+Inf"),))} {series[-1]}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {series[-2]}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {series[-1]}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.series = {} # labels -> value
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{format_labels(labels)} {value}')
+        return lines
+
+class Metrics:
+    def __init__(self, app=None):
+        self.requests = Counter('skillz_requests_total', 'Requests by route, method and status.')
+        self.latency = Histogram('skillz_request_duration_seconds', 'Request latency by route.', LATENCY_BUCKETS)
+        self.queries = Histogram('skillz_request_sql_queries', 'SQL queries per request by route.', QUERY_BUCKETS)
+        self.sql_time = Histogram('skillz_request_sql_seconds', 'Time spent in SQL per request by route.', LATENCY_BUCKETS)
+        self.template_time = Histogram('skillz_request_template_seconds', 'Time spent rendering templates per request by route.', LATENCY_BUCKETS)
+        self.collectors = [] # (name, type, help, function returning the value)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_SERVER_TIMING', False)
+        self.app = app
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._rendered, app)
+        # engine events are global, listen once however many apps the factory creates
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def collect(self, name, type, help, function):
+        self.collectors = [collector for collector in self.collectors if collector[0] != name]
+        self.collectors.append((name, type, help, function))
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_time = 0.0
+        g.metrics_template_time = 0.0
+        g.metrics_templates = [] # start times, templates may render templates
+
+    def _after_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        route = (('endpoint', request.endpoint or 'unmatched'),)
+
+        with self._lock:
+            self.requests.inc(route + (('method', request.method), ('status', response.status_code)))
+            self.latency.observe(route, elapsed)
+            self.queries.observe(route, g.metrics_queries)
+            self.sql_time.observe(route, g.metrics_sql_time)
+            self.template_time.observe(route, g.metrics_template_time)
+
+        if self.app.config['METRICS_SERVER_TIMING']:
+            response.headers.add('Server-Timing', ', '.join([
+                f'db;dur={g.metrics_sql_time * 1000:.1f};desc="{g.metrics_queries} queries"',
+                f'tmpl;dur={g.metrics_template_time * 1000:.1f}',
+                f'app;dur={elapsed * 1000:.1f}',
+            ]))
+        return response
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context() and 'metrics_templates' in g:
+            g.metrics_templates.append(time.perf_counter())
+
+    def _rendered(self, sender, template, context, **extra):
+        if has_request_context() and g.get('metrics_templates'):
+            start = g.metrics_templates.pop()
+            if not g.metrics_templates:
+                g.metrics_template_time += time.perf_counter() - start
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'metrics_queries' in g:
+            conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if starts and has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_sql_time += time.perf_counter() - starts.pop()
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.requests, self.latency, self.queries, self.sql_time, self.template_time):
+                lines += metric.render()
+        for name, type, help, function in self.collectors:
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {type}', f'{name} {function()}']
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
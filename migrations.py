@@ -0,0 +1,161 @@
+from sqlalchemy import inspect
+from models import db, LEVELS, SkillLevelEvent, TRIGGERS, create_triggers
+
+# Schema upgrades for existing databases. db.create_all() only creates missing
+# tables, so columns and indexes added later have to be applied here. Each step
+# must be idempotent: on a fresh database create_all() already did the work.
+# The number of applied steps is tracked in SQLite's PRAGMA user_version.
+
+def add_category_path(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('category')]
+    if 'path' not in columns:
+        connection.exec_driver_sql('ALTER TABLE category ADD COLUMN path VARCHAR')
+
+    connection.exec_driver_sql('''
+        WITH RECURSIVE tree(id, path) AS (
+            SELECT id, name FROM category WHERE parent_id IS NULL
+            UNION ALL
+            SELECT category.id, tree.path || ' / ' || category.name
+            FROM category JOIN tree ON category.parent_id = tree.id
+        )
+        UPDATE category SET path = (SELECT path FROM tree WHERE tree.id = category.id)
+        WHERE path IS NULL
+    ''')
+
+def backfill_skill_stats(connection):
+    levels = ', '.join(f'sum(level = {level})' for level in LEVELS)
+    columns = ', '.join(f'level_{level}' for level in LEVELS)
+    connection.exec_driver_sql('DELETE FROM skill_stats')
+    connection.exec_driver_sql(f'''
+        INSERT INTO skill_stats (skill_id, holders, level_sum, {columns})
+        SELECT skill_id, sum(level > 0), sum(level), {levels}
+        FROM user_skill WHERE skill_id IN (SELECT id FROM skill)
+        GROUP BY skill_id
+    ''')
+
+def add_user_skill_indexes(connection):
+    # keep the latest row of any duplicated (user, skill) pair before enforcing uniqueness
+    connection.exec_driver_sql('''
+        DELETE FROM user_skill WHERE id NOT IN (
+            SELECT max(id) FROM user_skill GROUP BY user_id, skill_id
+        )
+    ''')
+    connection.exec_driver_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_user_skill_user_id_skill_id ON user_skill (user_id, skill_id)'
+    )
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_user_skill_skill_id_level ON user_skill (skill_id, level)'
+    )
+
+def rebuild_skill_search(connection):
+    connection.exec_driver_sql('DELETE FROM skill_search')
+    connection.exec_driver_sql('''
+        INSERT INTO skill_search (rowid, name, path)
+        SELECT skill.id, skill.name, ifnull(category.path, '')
+        FROM skill LEFT JOIN category ON category.id = skill.category_id
+    ''')
+
+def add_user_listing_indexes(connection):
+    for statement in [
+        'CREATE INDEX IF NOT EXISTS ix_user_surname_id ON user (surname, id)',
+        'CREATE INDEX IF NOT EXISTS ix_user_last_login ON user (last_login)',
+        'CREATE INDEX IF NOT EXISTS ix_user_name_lower ON user (lower(name))',
+        'CREATE INDEX IF NOT EXISTS ix_user_surname_lower ON user (lower(surname))',
+        'CREATE INDEX IF NOT EXISTS ix_user_email_lower ON user (lower(email))',
+    ]:
+        connection.exec_driver_sql(statement)
+
+def add_audit_log_indexes(connection):
+    for statement in [
+        'CREATE INDEX IF NOT EXISTS ix_audit_log_timestamp ON audit_log (timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_audit_log_email_timestamp ON audit_log (email, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_audit_log_action_timestamp ON audit_log (action, timestamp)',
+    ]:
+        connection.exec_driver_sql(statement)
+
+def add_data_version_updated_at(connection):
+    columns = [column['name'] for column in inspect(connection).get_columns('data_version')]
+    if 'updated_at' not in columns:
+        connection.exec_driver_sql('ALTER TABLE data_version ADD COLUMN updated_at DATETIME')
+
+def backfill_skill_level_events(connection):
+    # the history starts with the levels held when it was introduced. Checked per pair: the
+    # triggers already log the rows changed by earlier steps (e.g. the duplicates removed by
+    # add_user_skill_indexes), a pair is backfilled unless its latest event has its level
+    connection.exec_driver_sql('''
+        INSERT INTO skill_level_event (user_id, skill_id, level, previous_level, timestamp)
+        SELECT user_id, skill_id, level, latest, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000'
+        FROM (
+            SELECT user_skill.user_id, user_skill.skill_id, user_skill.level, ifnull((
+                SELECT event.level FROM skill_level_event AS event
+                WHERE event.user_id = user_skill.user_id AND event.skill_id = user_skill.skill_id
+                ORDER BY event.id DESC LIMIT 1
+            ), 0) AS latest
+            FROM user_skill
+            WHERE user_skill.level > 0
+        )
+        WHERE level != latest
+        ORDER BY user_id, skill_id
+    ''')
+
+def make_skill_level_event_ids_autoincrement(connection):
+    # a plain INTEGER PRIMARY KEY reuses the ids of deleted rows (remove_privacy deletes a
+    # user's events), which readers following the log by id would miss. SQLite only adds
+    # AUTOINCREMENT to a copy of the table; the triggers writing to it are dropped meanwhile,
+    # the rename fails while they refer to a missing table
+    sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'skill_level_event'"
+    ).scalar()
+    if 'AUTOINCREMENT' in sql.upper():
+        return
+    for name in TRIGGERS:
+        connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    for index in SkillLevelEvent.__table__.indexes:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')
+    connection.exec_driver_sql('ALTER TABLE skill_level_event RENAME TO skill_level_event_old')
+    SkillLevelEvent.__table__.create(connection)
+    connection.exec_driver_sql('''
+        INSERT INTO skill_level_event (id, user_id, skill_id, level, previous_level, timestamp)
+        SELECT id, user_id, skill_id, level, previous_level, timestamp FROM skill_level_event_old
+    ''')
+    connection.exec_driver_sql('DROP TABLE skill_level_event_old')
+    create_triggers(db.metadata, connection)
+
+def index_users_by_surname_or_empty(connection):
+    # the listing sorts a NULL surname as '', see USER_SORT_SURNAME
+    connection.exec_driver_sql('DROP INDEX IF EXISTS ix_user_surname_id')
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_user_sort_surname_id ON user (ifnull(surname, ''), id)"
+    )
+
+def add_user_filter_indexes(connection):
+    for column in ('role', 'senior', 'accepted_privacy'):
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_user_{column}_sort_surname_id ON user ({column}, ifnull(surname, ''), id)"
+        )
+
+MIGRATIONS = [
+    add_category_path,
+    backfill_skill_stats,
+    add_user_skill_indexes,
+    rebuild_skill_search,
+    add_user_listing_indexes,
+    add_audit_log_indexes,
+    add_data_version_updated_at,
+    backfill_skill_level_events,
+    make_skill_level_event_ids_autoincrement,
+    index_users_by_surname_or_empty,
+    add_user_filter_indexes,
+]
+
+def upgrade():
+    with db.engine.begin() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {number}')
+
+def init_db():
+    """Create the missing tables and apply the pending upgrades, once per deployment (`flask init-db`)."""
+    db.create_all()
+    upgrade()
@@ -1,16 +1,62 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import event
-from flask import session
+from sqlalchemy import delete, event, select, table, column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from flask import has_request_context, session
 import json
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-def model_audit_log(action, data):
-    email = session.get('email', 'anonymous')
+# session.info key of the audit records waiting for the transaction to commit
+PENDING_AUDIT_RECORDS = 'pending_audit_records'
+
+def audit_record(action, data):
+    email = session.get('email', 'anonymous') if has_request_context() else 'anonymous'
     data = json.dumps(data) # thank you
-    new_log = AuditLog(email=email, action=action, data=data)
-    db.session.add(new_log)
+    return {'email': email, 'action': action, 'timestamp': datetime.now(), 'data': data}
+
+def model_audit_log(action, data):
+    # handed to the audit writer only if the surrounding transaction commits
+    db.session.info.setdefault(PENDING_AUDIT_RECORDS, []).append(audit_record(action, data))
+
+# keys of the DataVersion counters
+TAXONOMY = 'taxonomy' # categories and skills
+USER_SKILLS = 'user_skills' # user_skill rows
+USERS = 'users' # user attributes shown next to levels, e.g. senior
+
+def user_key(user_id):
+    return f'user:{user_id}' # levels of one user
+
+def skill_key(skill_id):
+    return f'skill:{skill_id}' # levels held in one skill
+
+def _version_upsert():
+    statement = sqlite_insert(DataVersion)
+    return statement.on_conflict_do_update(
+        index_elements=[DataVersion.key],
+        set_={'version': DataVersion.version + 1, 'updated_at': statement.excluded.updated_at}
+    )
+
+def bump_version(connection, key):
+    statement = _version_upsert().returning(DataVersion.version)
+    return connection.execute(statement, {'key': key, 'version': 1, 'updated_at': datetime.now()}).scalar()
+
+def bump_versions(connection, keys):
+    now = datetime.now()
+    params = [{'key': key, 'version': 1, 'updated_at': now} for key in set(keys)]
+    if params:
+        connection.execute(_version_upsert(), params)
+
+def get_version(key):
+    version = db.session.execute(select(DataVersion.version).where(DataVersion.key == key)).scalar()
+    return version or 0
+
+def get_versions(*keys):
+    rows = db.session.execute(select(DataVersion.key, DataVersion.version).where(DataVersion.key.in_(keys)))
+    versions = dict.fromkeys(keys, 0)
+    versions.update(rows.all())
+    return versions
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -24,37 +70,56 @@ class User(db.Model):
     last_login = db.Column(db.DateTime, default=None)
 
     def get_skills(self):
-        skills_info = []
-        user_skills = UserSkill.query.filter_by(user_id=self.id).all()
-        
-        for user_skill in user_skills:
-            skill = Skill.query.get(user_skill.skill_id)
-            category_path = []
-            current_category = skill.category
-            
-            while current_category is not None:
-                category_path.insert(0, current_category.name)
-                current_category = current_category.parent
-            
-            category_path = ' / '.join(category_path)
-            skills_info.append({
-                'id': skill.id,
-                'category': category_path,
-                'skill_name': skill.name,
-                'level': user_skill.level
-            })
-        
-        return skills_info
+        rows = db.session.query(Skill.id, Skill.name, Category.path, UserSkill.level) \
+            .join(UserSkill, UserSkill.skill_id == Skill.id) \
+            .outerjoin(Category, Skill.category_id == Category.id) \
+            .filter(UserSkill.user_id == self.id) \
+            .order_by(Category.path, Skill.name) \
+            .all()
+
+        return [{
+            'id': skill_id,
+            'category': category_path or '',
+            'skill_name': skill_name,
+            'level': level
+        } for skill_id, skill_name, category_path, level in rows]
     
     def format_last_login(self):
         if self.last_login is None:
             return ''
         return self.last_login.strftime('%Y-%m-%d')
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'email': self.email,
+            'name': self.name,
+            'surname': self.surname,
+            'role': self.role,
+            'senior': self.senior,
+            'accepted_privacy': self.accepted_privacy,
+            'last_login': self.last_login.isoformat() if self.last_login else None
+        }
+
+# users are listed by surname and searched by name, surname or email prefix.
+# A NULL surname (rows created before it was required) is listed as '': row
+# values holding a NULL never compare greater, keyset pages would skip them
+USER_SORT_SURNAME = db.func.ifnull(User.surname, db.literal_column("''"))
+db.Index('ix_user_sort_surname_id', USER_SORT_SURNAME, User.id)
+# the equality filters of the listing, each still walking users in listing order
+db.Index('ix_user_role_sort_surname_id', User.role, USER_SORT_SURNAME, User.id)
+db.Index('ix_user_senior_sort_surname_id', User.senior, USER_SORT_SURNAME, User.id)
+db.Index('ix_user_accepted_privacy_sort_surname_id', User.accepted_privacy, USER_SORT_SURNAME, User.id)
+db.Index('ix_user_last_login', User.last_login)
+db.Index('ix_user_name_lower', db.func.lower(User.name))
+db.Index('ix_user_surname_lower', db.func.lower(User.surname))
+db.Index('ix_user_email_lower', db.func.lower(User.email))
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True)
     parent_id = db.Column(db.Integer, db.ForeignKey('category.id'))
+    path = db.Column(db.String) # materialized "Parent / Child / Name", set on insert
     parent = db.relationship('Category', remote_side=[id])
     children = db.relationship('Category', cascade="all, delete-orphan")
     
@@ -74,15 +139,16 @@ class Skill(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
-    
+    stats = db.relationship('SkillStats', uselist=False, viewonly=True)
 
     def count_users(self):
-        return UserSkill.query.filter_by(skill_id=self.id).count()
+        return self.stats.holders if self.stats else 0
     
     def avg_level(self):
-        value = UserSkill.query.filter_by(skill_id=self.id).with_entities(db.func.avg(UserSkill.level)).scalar()
-        rounded_value = round(value, 1) if value is not None else 0
-        return rounded_value
+        return self.stats.avg_level() if self.stats else 0
+
+    def level_histogram(self):
+        return self.stats.level_histogram() if self.stats else [0] * len(LEVELS)
 
 class UserSkill(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -91,6 +157,140 @@ class UserSkill(db.Model):
     level = db.Column(db.Integer) # 1-5
     user = db.relationship('User', backref='user_skills')
 
+    __table_args__ = (
+        db.Index('uq_user_skill_user_id_skill_id', 'user_id', 'skill_id', unique=True),
+        db.Index('ix_user_skill_skill_id_level', 'skill_id', 'level'),
+    )
+
+LEVELS = range(1, 6)
+
+class SkillStats(db.Model):
+    # per-skill aggregates of UserSkill, maintained by the triggers below
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), primary_key=True)
+    holders = db.Column(db.Integer, nullable=False, default=0)
+    level_sum = db.Column(db.Integer, nullable=False, default=0)
+    level_1 = db.Column(db.Integer, nullable=False, default=0)
+    level_2 = db.Column(db.Integer, nullable=False, default=0)
+    level_3 = db.Column(db.Integer, nullable=False, default=0)
+    level_4 = db.Column(db.Integer, nullable=False, default=0)
+    level_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    def avg_level(self):
+        if not self.holders:
+            return 0
+        return round(self.level_sum / self.holders, 1)
+
+    def level_histogram(self):
+        return [getattr(self, f'level_{level}') for level in LEVELS]
+
+class SkillLevelEvent(db.Model):
+    # append-only history of user_skill levels, written by the triggers below.
+    # level 0 means the row was removed; compacted into snapshots by history.py
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    skill_id = db.Column(db.Integer, nullable=False)
+    level = db.Column(db.Integer, nullable=False)
+    previous_level = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_skill_level_event_skill_id_id', 'skill_id', 'id'),
+        db.Index('ix_skill_level_event_user_id', 'user_id'),
+        db.Index('ix_skill_level_event_timestamp', 'timestamp'),
+        # ids are never reused, so readers can follow the log by id (see skill_index.py)
+        {'sqlite_autoincrement': True},
+    )
+
+class HistoryPurge(db.Model):
+    # users whose consent was revoked and who are still to be removed from the history
+    # snapshots; written with the revocation, done by the next `flask compact-history`
+    user_id = db.Column(db.Integer, primary_key=True)
+    requested_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+_LEVEL_COLUMNS = ', '.join(f'level_{n}' for n in LEVELS)
+
+def _skill_stats_ensure(row):
+    # not INSERT OR IGNORE: an upsert on user_skill would override its conflict policy
+    zeros = ', '.join('0' for n in LEVELS)
+    return f'''INSERT INTO skill_stats (skill_id, holders, level_sum, {_LEVEL_COLUMNS})
+            SELECT {row}.skill_id, 0, 0, {zeros}
+            WHERE NOT EXISTS (SELECT 1 FROM skill_stats WHERE skill_id = {row}.skill_id);'''
+
+def _skill_stats_delta(row, sign):
+    # SET clause adding (sign=+) or removing (sign=-) one user_skill row
+    level = f'ifnull({row}.level, 0)'
+    assignments = [
+        f'holders = holders {sign} ({level} > 0)',
+        f'level_sum = level_sum {sign} {level}',
+    ] + [f'level_{n} = level_{n} {sign} ({level} = {n})' for n in LEVELS]
+    return f'UPDATE skill_stats SET {", ".join(assignments)} WHERE skill_id = {row}.skill_id;'
+
+# local time with microseconds, the format SQLAlchemy stores datetime.now() in
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000'"
+
+def _level_event(user_id, skill_id, level, previous_level, condition='1'):
+    return f'''INSERT INTO skill_level_event (user_id, skill_id, level, previous_level, timestamp)
+            SELECT {user_id}, {skill_id}, ifnull({level}, 0), ifnull({previous_level}, 0), {_NOW}
+            WHERE {condition};'''
+
+_SAME_ROW = 'OLD.user_id IS NEW.user_id AND OLD.skill_id IS NEW.skill_id'
+
+TRIGGERS = {
+    'user_skill_stats_insert': f'''AFTER INSERT ON user_skill BEGIN
+        {_skill_stats_ensure('NEW')}
+        {_skill_stats_delta('NEW', '+')}
+    END''',
+    'user_skill_stats_update': f'''AFTER UPDATE OF level, skill_id ON user_skill BEGIN
+        {_skill_stats_delta('OLD', '-')}
+        {_skill_stats_ensure('NEW')}
+        {_skill_stats_delta('NEW', '+')}
+    END''',
+    'user_skill_stats_delete': f'''AFTER DELETE ON user_skill BEGIN
+        {_skill_stats_delta('OLD', '-')}
+    END''',
+    'user_skill_history_insert': f'''AFTER INSERT ON user_skill BEGIN
+        {_level_event('NEW.user_id', 'NEW.skill_id', 'NEW.level', '0')}
+    END''',
+    'user_skill_history_update': f'''AFTER UPDATE OF level, skill_id, user_id ON user_skill BEGIN
+        {_level_event('OLD.user_id', 'OLD.skill_id', '0', 'OLD.level', f'NOT ({_SAME_ROW})')}
+        {_level_event('NEW.user_id', 'NEW.skill_id', 'NEW.level', f'CASE WHEN {_SAME_ROW} THEN OLD.level END',
+                      f'NOT ({_SAME_ROW} AND ifnull(OLD.level, 0) = ifnull(NEW.level, 0))')}
+    END''',
+    'user_skill_history_delete': f'''AFTER DELETE ON user_skill BEGIN
+        {_level_event('OLD.user_id', 'OLD.skill_id', '0', 'OLD.level')}
+    END''',
+    'skill_stats_skill_delete': '''AFTER DELETE ON skill BEGIN
+        DELETE FROM skill_stats WHERE skill_id = OLD.id;
+    END''',
+}
+
+# full-text index of skill names and category paths, rowid = skill.id
+SKILL_SEARCH_TABLE = '''CREATE VIRTUAL TABLE IF NOT EXISTS skill_search USING fts5(
+    name, path, prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+)'''
+
+def index_skill(connection, skill_id, name, category_id):
+    path = connection.execute(select(Category.path).where(Category.id == category_id)).scalar()
+    connection.exec_driver_sql(
+        'INSERT INTO skill_search (rowid, name, path) VALUES (?, ?, ?)',
+        (skill_id, name, path or '')
+    )
+
+def unindex_skill(connection, skill_id):
+    connection.exec_driver_sql('DELETE FROM skill_search WHERE rowid = ?', (skill_id,))
+
+@event.listens_for(db.metadata, 'after_create')
+def create_triggers(target, connection, **kw):
+    # triggers keep aggregates correct for bulk deletes too, which bypass ORM events.
+    # They are recreated at every `flask init-db` so existing databases get the current definition,
+    # in one transaction: two init runs at once must not interleave drops and creates.
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    for name, body in TRIGGERS.items():
+        connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+        connection.exec_driver_sql(f'CREATE TRIGGER {name} {body}')
+    connection.exec_driver_sql(SKILL_SEARCH_TABLE)
+
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String) 
@@ -98,8 +298,37 @@ class AuditLog(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
     data = db.Column(db.String)
 
+    # the rowid is implicitly the last column of every index, so each one
+    # also serves the (timestamp, id) keyset ordering of the audit viewer
+    __table_args__ = (
+        db.Index('ix_audit_log_timestamp', 'timestamp'),
+        db.Index('ix_audit_log_email_timestamp', 'email', 'timestamp'),
+        db.Index('ix_audit_log_action_timestamp', 'action', 'timestamp'),
+    )
+
+    def to_dict(self):
+        try:
+            data = json.loads(self.data) if self.data else None
+        except ValueError:
+            data = self.data
+        return {
+            'id': self.id,
+            'email': self.email,
+            'action': self.action,
+            'timestamp': self.timestamp.isoformat(sep=' ', timespec='microseconds') if self.timestamp else None,
+            'data': data,
+        }
+
+class DataVersion(db.Model):
+    # monotonic counters shared by all workers, used to invalidate in-process caches
+    key = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
 @event.listens_for(Skill, 'after_insert')
 def skill_after_insert(mapper, connection, target):
+    bump_version(connection, TAXONOMY)
+    index_skill(connection, target.id, target.name, target.category_id)
     model_audit_log(
         action='create skill', 
         data={
@@ -112,9 +341,12 @@ def skill_after_insert(mapper, connection, target):
 @event.listens_for(Skill, 'before_delete')
 def skill_before_delete(mapper, connection, target):
     UserSkill.query.filter_by(skill_id=target.id).delete()
+    bump_version(connection, USER_SKILLS)
 
 @event.listens_for(Skill, 'after_delete')
 def skill_after_delete(mapper, connection, target):
+    bump_version(connection, TAXONOMY)
+    unindex_skill(connection, target.id)
     model_audit_log(
         action='delete skill', 
         data={
@@ -123,8 +355,61 @@ def skill_after_delete(mapper, connection, target):
     })
 
 
+# Set-based deletes: a few DELETE ... WHERE IN statements instead of the ORM
+# cascade, which loads every descendant and runs the listeners above per row.
+
+skill_search = table('skill_search', column('rowid'))
+
+def delete_skills(connection, skill_ids):
+    """Delete the skills selected by skill_ids (a select of ids) with their levels.
+
+    Returns the number of levels removed.
+    """
+    keys = [skill_key(skill_id) for skill_id in connection.execute(skill_ids).scalars()]
+    # counted up front: sqlite3 reports no rowcount for statements starting with a WITH clause
+    levels = connection.execute(
+        select(db.func.count()).select_from(UserSkill).where(UserSkill.skill_id.in_(skill_ids))
+    ).scalar()
+    # stats first: the user_skill delete trigger then has no aggregate left to update
+    connection.execute(delete(SkillStats).where(SkillStats.skill_id.in_(skill_ids)))
+    connection.execute(delete(UserSkill).where(UserSkill.skill_id.in_(skill_ids)))
+    connection.execute(delete(skill_search).where(skill_search.c.rowid.in_(skill_ids)))
+    connection.execute(delete(Skill).where(Skill.id.in_(skill_ids)))
+
+    bump_version(connection, TAXONOMY)
+    bump_version(connection, USER_SKILLS)
+    bump_versions(connection, keys)
+    return levels
+
+def delete_category_tree(connection, category_id):
+    """Delete a category with all its descendants and their skills.
+
+    Returns the number of categories, skills and levels removed.
+    """
+    subtree = select(Category.id).where(Category.id == category_id).cte('subtree', recursive=True)
+    subtree = subtree.union_all(select(Category.id).join(subtree, Category.parent_id == subtree.c.id))
+    category_ids = select(subtree.c.id)
+    skill_ids = select(Skill.id).where(Skill.category_id.in_(category_ids))
+
+    categories = connection.execute(select(db.func.count()).select_from(subtree)).scalar()
+    skills = connection.execute(select(db.func.count()).select_from(skill_ids.subquery())).scalar()
+    levels = delete_skills(connection, skill_ids)
+    connection.execute(delete(Category).where(Category.id.in_(category_ids)))
+    return categories, skills, levels
+
+@event.listens_for(Category, 'before_insert')
+def category_before_insert(mapper, connection, target):
+    # categories are never renamed or moved, so the path only has to be computed once
+    parent_path = None
+    if target.parent_id is not None:
+        parent_path = connection.execute(
+            select(Category.path).where(Category.id == target.parent_id)
+        ).scalar()
+    target.path = f'{parent_path} / {target.name}' if parent_path else target.name
+
 @event.listens_for(Category, 'after_insert')
 def category_after_insert(mapper, connection, target):
+    bump_version(connection, TAXONOMY)
     model_audit_log(
         action='create category', 
         data={
@@ -136,6 +421,7 @@ def category_after_insert(mapper, connection, target):
 
 @event.listens_for(Category, 'after_delete')
 def category_after_delete(mapper, connection, target):
+    bump_version(connection, TAXONOMY)
     model_audit_log(
         action='delete category', 
         data={
@@ -0,0 +1,42 @@
+import base64
+import json
+import string
+
+# Keyset pagination: a page ends with the sort key of its last row, encoded as
+# an opaque cursor; the next page selects rows sorting after that key.
+
+def encode_cursor(values):
+    data = json.dumps(values, default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+class InvalidCursor(ValueError):
+    pass
+
+def decode_cursor(cursor, *types):
+    """The values of a cursor, one per type and an instance of it; None for no cursor.
+
+    Raises InvalidCursor for a cursor that encode_cursor could not have made with
+    values of these types, which the views answer with a 400.
+    """
+    if not cursor:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(types):
+        raise InvalidCursor(cursor)
+    if not all(isinstance(value, type_) for value, type_ in zip(values, types)):
+        raise InvalidCursor(cursor)
+    return values
+
+# SQLite's lower() only folds ASCII letters: lower('Élodie') is 'Élodie', which
+# a prefix folded by str.lower() ('élodie') would never match
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def prefix_range(column, prefix):
+    # lower(column) LIKE 'prefix%' written as a range, so an index on lower(column) is used
+    prefix = prefix.translate(ASCII_LOWER)
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (column >= prefix) & (column < upper)
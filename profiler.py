@@ -0,0 +1,144 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from datetime import datetime
+from flask import g, request
+
+# Sampling profiler for production. Admins choose endpoints and the fraction of
+# their requests to profile; the settings are stored in a JSON file in the
+# instance folder so every worker picks them up, checked at most every
+# PROFILER_CHECK_INTERVAL seconds. A sampled request runs under cProfile and
+# its stats are written to PROFILER_DIR as <endpoint>-<time>-<ms>ms.pstats.
+# With no endpoint configured a request only pays a clock comparison.
+
+PROFILE_SUFFIX = '.pstats'
+
+class Profiler:
+    def __init__(self, app=None):
+        self.rates = {} # endpoint -> fraction of requests to profile
+        self._mtime = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_SETTINGS', os.path.join(app.instance_path, 'profiling.json'))
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILER_CHECK_INTERVAL', 5)
+        app.config.setdefault('PROFILER_MAX_PROFILES', 20)
+        self.app = app
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.app.config['PROFILER_CHECK_INTERVAL']:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.app.config['PROFILER_SETTINGS']).st_mtime
+            except OSError:
+                self.rates = {}
+                self._mtime = None
+                return
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.rates = self.load_settings()
+
+    def load_settings(self):
+        if not os.path.exists(self.app.config['PROFILER_SETTINGS']):
+            return {}
+        try:
+            with open(self.app.config['PROFILER_SETTINGS']) as stream:
+                return {endpoint: float(rate) for endpoint, rate in json.load(stream).get('endpoints', {}).items()}
+        except (OSError, ValueError, AttributeError):
+            self.app.logger.exception('Invalid profiler settings')
+            return {}
+
+    def save_settings(self, rates):
+        path = self.app.config['PROFILER_SETTINGS']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, a worker never reads half a file
+        with open(path + '.tmp', 'w') as stream:
+            json.dump({'endpoints': rates}, stream, indent=2)
+        os.replace(path + '.tmp', path)
+        self._checked = 0
+
+    def _before_request(self):
+        self._reload()
+        if not self.rates:
+            return
+        rate = self.rates.get(request.endpoint)
+        if rate and random.random() < rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # another request of this process is being profiled (Python 3.12+)
+                return
+            g.profile = profile
+            g.profile_started = time.perf_counter()
+
+    def _teardown_request(self, exception):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        elapsed = time.perf_counter() - g.pop('profile_started')
+        try:
+            self._save(profile, request.endpoint, elapsed)
+        except OSError:
+            self.app.logger.exception('Failed to save the profile of %s', request.endpoint)
+
+    def _save(self, profile, endpoint, elapsed):
+        directory = self.app.config['PROFILER_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = f'{endpoint}-{datetime.now():%Y%m%d-%H%M%S-%f}-{elapsed * 1000:.0f}ms{PROFILE_SUFFIX}'
+        profile.dump_stats(os.path.join(directory, name))
+
+        # keep the most recent profiles of each endpoint
+        older = [entry for entry in self.profiles() if entry['endpoint'] == endpoint]
+        for entry in older[self.app.config['PROFILER_MAX_PROFILES']:]:
+            try:
+                os.remove(os.path.join(directory, entry['name']))
+            except OSError:
+                pass
+
+    def profiles(self):
+        """Saved profiles, most recent first."""
+        directory = self.app.config['PROFILER_DIR']
+        if not os.path.isdir(directory):
+            return []
+        entries = []
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(PROFILE_SUFFIX):
+                continue
+            try:
+                endpoint, day, clock, micro, duration = entry.name[:-len(PROFILE_SUFFIX)].rsplit('-', 4)
+                created_at = datetime.strptime(f'{day}-{clock}-{micro}', '%Y%m%d-%H%M%S-%f')
+            except ValueError:
+                continue
+            entries.append({
+                'name': entry.name,
+                'endpoint': endpoint,
+                'created_at': created_at,
+                'duration_ms': int(duration[:-len('ms')]),
+                'size': entry.stat().st_size,
+            })
+        entries.sort(key=lambda entry: entry['created_at'], reverse=True)
+        return entries
+
+    def report(self, name, sort='cumulative', limit=40):
+        stream = io.StringIO()
+        stats = pstats.Stats(os.path.join(self.app.config['PROFILER_DIR'], name), stream=stream)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+profiler = Profiler()
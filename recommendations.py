@@ -0,0 +1,264 @@
+import threading
+import time
+import numpy as np
+from flask import current_app, g
+from scipy import sparse
+from analytics import load_matrix
+from models import TAXONOMY, USER_SKILLS, USERS, get_versions
+from tree_cache import tree_cache
+
+# Precomputed recommendations: for every user the TOP_K most similar colleagues
+# (cosine similarity of their level vectors) and for every skill the TOP_K
+# skills most often held together with it (cosine similarity of the holder
+# sets). Lookups are array indexing. Level changes made by this worker update
+# the lists in place: the changed user's list and the lists of the skills they
+# added or dropped are recomputed exactly, the other users' lists only pick up
+# the changed user's new score, so they stay approximate until the next full
+# rebuild. Changes made by other workers are picked up by that rebuild, at
+# most every REBUILD_INTERVAL seconds: with several workers every write would
+# otherwise make each of them rebuild on its next page view. The rebuild runs
+# on a background thread and is swapped in when done; until then lookups
+# answer from the previous lists, or with nothing before the first build.
+
+TOP_K = 10
+BLOCK_SIZE = 512 # rows of the similarity matrix computed at once
+REBUILD_INTERVAL = 60 # seconds
+
+def top_k(scores, k):
+    """Column positions and scores of the k best scores of every row, best first; -1 where there are none."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.full((scores.shape[0], 0), -1, dtype=np.int32), np.zeros((scores.shape[0], 0), dtype=np.float32)
+    positions = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best = np.take_along_axis(scores, positions, axis=1)
+    order = np.argsort(-best, axis=1, kind='stable')
+    positions = np.take_along_axis(positions, order, axis=1).astype(np.int32)
+    best = np.take_along_axis(best, order, axis=1).astype(np.float32)
+    positions[best <= 0] = -1
+    best[best <= 0] = 0
+    return positions, best
+
+def inverse(values):
+    return np.divide(1, values, out=np.zeros(len(values), dtype=np.float32), where=values > 0)
+
+class RecommendationModel:
+    """The lists computed from one load of the level matrix, updated in place by this worker's writes."""
+
+    def __init__(self, versions):
+        skill_ids = np.array(sorted(tree_cache.get().skills), dtype=np.int64)
+        matrix, user_ids, _ = load_matrix(skill_ids)
+
+        self.user_ids = user_ids
+        self.skill_ids = skill_ids
+        self.user_positions = {int(user_id): position for position, user_id in enumerate(user_ids)}
+        self.skill_positions = {int(skill_id): position for position, skill_id in enumerate(skill_ids)}
+        self.levels = matrix.astype(np.float32)
+        self.norms = np.sqrt(np.asarray(self.levels.multiply(self.levels).sum(axis=1)).ravel())
+        self.holders = np.asarray((self.levels > 0).sum(axis=0)).ravel().astype(np.float32)
+
+        normalized = (sparse.diags(inverse(self.norms)) @ self.levels).tocsr()
+        self.similar_users = np.full((len(user_ids), min(TOP_K, len(user_ids))), -1, dtype=np.int32)
+        self.user_scores = np.zeros(self.similar_users.shape, dtype=np.float32)
+        for start in range(0, len(user_ids), BLOCK_SIZE):
+            block = (normalized[start:start + BLOCK_SIZE] @ normalized.T).toarray()
+            rows = np.arange(block.shape[0])
+            block[rows, start + rows] = 0
+            self.similar_users[start:start + BLOCK_SIZE], self.user_scores[start:start + BLOCK_SIZE] = top_k(block, TOP_K)
+
+        self.related_skills = np.full((len(skill_ids), min(TOP_K, len(skill_ids))), -1, dtype=np.int32)
+        self.skill_scores = np.zeros(self.related_skills.shape, dtype=np.float32)
+        for start in range(0, len(skill_ids), BLOCK_SIZE):
+            columns = np.arange(start, min(start + BLOCK_SIZE, len(skill_ids)))
+            self.related_skills[columns], self.skill_scores[columns] = self._related(columns)
+
+        self.built_from = dict(versions)
+        self.versions = dict(versions)
+
+    def _related(self, columns):
+        held = (self.levels > 0).astype(np.float32)
+        together = (held[:, columns].T @ held).toarray()
+        scores = together * inverse(np.sqrt(self.holders[columns]))[:, None] * inverse(np.sqrt(self.holders))[None, :]
+        scores[np.arange(len(columns)), columns] = 0
+        return top_k(scores, TOP_K)
+
+    def advance(self, key, version):
+        # this worker's own writes are applied even when other changes were missed,
+        # the versions only move on when nothing was, so the rebuild still comes
+        if self.versions[key] == version - 1:
+            self.versions[key] = version
+
+    def set_levels(self, user_id, levels):
+        """Apply a user's new levels, False when the user or a skill is not in the model."""
+        position = self.user_positions.get(user_id)
+        columns = [self.skill_positions.get(skill_id) for skill_id in levels]
+        if position is None or None in columns:
+            return False
+        row = self.levels[position].toarray().ravel()
+        before = row > 0
+        row[columns] = list(levels.values())
+        self._set_row(position, row, before)
+        return True
+
+    def remove_user(self, user_id):
+        position = self.user_positions.get(user_id)
+        if position is None:
+            return True
+        row = self.levels[position].toarray().ravel()
+        before = row > 0
+        self._set_row(position, np.zeros_like(row), before)
+        return True
+
+    def _set_row(self, position, row, before):
+        self.levels = sparse.vstack(
+            [self.levels[:position], sparse.csr_matrix(row), self.levels[position + 1:]], format='csr'
+        )
+        self.norms[position] = np.sqrt(row @ row)
+
+        # the changed user's list, and their new score in everybody else's
+        scores = (self.levels @ row) * inverse(self.norms) * (1 / self.norms[position] if self.norms[position] else 0)
+        scores[position] = 0
+        self.similar_users[position], self.user_scores[position] = top_k(scores[None, :], TOP_K)
+
+        listed = self.similar_users == position
+        self.user_scores[listed] = scores[listed.any(axis=1)]
+        candidates = ~listed.any(axis=1) & (scores > self.user_scores[:, -1])
+        candidates[position] = False
+        self.similar_users[candidates, -1] = position
+        self.user_scores[candidates, -1] = scores[candidates]
+        changed = listed.any(axis=1) | candidates
+        order = np.argsort(-self.user_scores[changed], axis=1, kind='stable')
+        self.similar_users[changed] = np.take_along_axis(self.similar_users[changed], order, axis=1)
+        self.user_scores[changed] = np.take_along_axis(self.user_scores[changed], order, axis=1)
+        self.similar_users[self.user_scores <= 0] = -1
+
+        # skills added or dropped
+        after = row > 0
+        columns = np.flatnonzero(before != after)
+        if len(columns):
+            self.holders[columns] += np.where(after[columns], 1, -1)
+            self.related_skills[columns], self.skill_scores[columns] = self._related(columns)
+
+    def similar_users_of(self, user_id, limit=5):
+        """[(user_id, similarity)] of the colleagues with the most similar levels."""
+        position = self.user_positions.get(user_id)
+        if position is None:
+            return []
+        return [
+            (int(self.user_ids[other]), float(score))
+            for other, score in zip(self.similar_users[position][:limit], self.user_scores[position][:limit])
+            if other >= 0
+        ]
+
+    def related_skills_of(self, skill_id, limit=5):
+        """[(skill_id, similarity)] of the skills most often held together with skill_id."""
+        position = self.skill_positions.get(skill_id)
+        if position is None:
+            return []
+        return [
+            (int(self.skill_ids[other]), float(score))
+            for other, score in zip(self.related_skills[position][:limit], self.skill_scores[position][:limit])
+            if other >= 0
+        ]
+
+    def next_skills_of(self, user_id, limit=5):
+        """[(skill_id, score)] not held by the user, related to the skills they are best at."""
+        position = self.user_positions.get(user_id)
+        if position is None:
+            return []
+        row = self.levels[position]
+        scores = {}
+        for column, level in zip(row.indices, row.data):
+            for other, score in zip(self.related_skills[column], self.skill_scores[column]):
+                if other >= 0:
+                    scores[other] = scores.get(other, 0) + score * level
+        held = set(row.indices)
+        best = sorted((item for item in scores.items() if item[0] not in held), key=lambda item: -item[1])[:limit]
+        return [(int(self.skill_ids[column]), float(score)) for column, score in best]
+
+class Recommendations:
+    def __init__(self):
+        self.model = None
+        self.checked_at = None
+        self._pending = [] # changes made by this worker while a build runs
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _building(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _refresh(self):
+        # called with the lock held; the build never runs on the request's thread,
+        # lookups keep answering from the previous model, or with nothing, meanwhile
+        now = time.monotonic()
+        if self._building() or (self.checked_at is not None and now - self.checked_at < REBUILD_INTERVAL):
+            return
+        self.checked_at = now
+        versions = get_versions(TAXONOMY, USER_SKILLS, USERS)
+        if self.model is not None and versions == self.model.versions:
+            return
+        self._pending = []
+        self._thread = threading.Thread(target=self._build, args=(current_app._get_current_object(), versions), daemon=True)
+        self._thread.start()
+
+    def _build(self, app, versions):
+        try:
+            with app.app_context():
+                g.read_only = True
+                model = RecommendationModel(versions)
+        except Exception:
+            app.logger.exception('Failed to build the recommendations')
+            return
+        with self._lock:
+            # the matrix may have been read before this worker's latest writes
+            for key, version, change in self._pending:
+                model.advance(key, version)
+                change(model)
+            self._pending = []
+            self.model = model
+
+    def rebuild(self):
+        """Build on the caller's thread and swap the result in, for scripts and benchmarks."""
+        with self._lock:
+            self.checked_at = time.monotonic()
+            versions = get_versions(TAXONOMY, USER_SKILLS, USERS)
+        self._build(current_app._get_current_object(), versions)
+
+    def _apply(self, key, version, change):
+        with self._lock:
+            if self._building():
+                self._pending.append((key, version, change))
+            if self.model is None:
+                return
+            self.model.advance(key, version)
+            if not change(self.model):
+                # a user or skill newer than the model, look for a rebuild on the next lookup
+                self.checked_at = None
+
+    def apply_levels(self, user_id, levels, version):
+        self._apply(USER_SKILLS, version, lambda model: model.set_levels(user_id, levels))
+
+    def remove_user(self, user_id, version):
+        self._apply(USER_SKILLS, version, lambda model: model.remove_user(user_id))
+
+    def state(self):
+        """The versions the current lists were built from, None before the first build; part of page ETags."""
+        with self._lock:
+            self._refresh()
+            return self.model.built_from if self.model is not None else None
+
+    def similar_users_of(self, user_id, limit=5):
+        with self._lock:
+            self._refresh()
+            return self.model.similar_users_of(user_id, limit) if self.model is not None else []
+
+    def related_skills_of(self, skill_id, limit=5):
+        with self._lock:
+            self._refresh()
+            return self.model.related_skills_of(skill_id, limit) if self.model is not None else []
+
+    def next_skills_of(self, user_id, limit=5):
+        with self._lock:
+            self._refresh()
+            return self.model.next_skills_of(user_id, limit) if self.model is not None else []
+
+recommendations = Recommendations()
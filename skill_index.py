@@ -0,0 +1,146 @@
+import heapq
+import threading
+from collections import Counter
+from sqlalchemy import column, select, table
+from models import db, User, UserSkill, SkillLevelEvent, USER_SKILLS, USERS, get_versions
+
+# In-memory inverted index of UserSkill: for every skill, the users holding it
+# and their level. Writes made by this worker are applied in place. Changes of
+# the shared version counters made by anyone else are caught up on the next
+# lookup by replaying the skill_level_event rows written since the last one
+# applied (and reloading the senior users). The event ids are AUTOINCREMENT, so
+# a missing id means events were deleted (remove_privacy drops a user's
+# history): what changed is then unknown and the index is rebuilt.
+
+sqlite_sequence = table('sqlite_sequence', column('name'), column('seq'))
+
+def last_event_id():
+    return db.session.execute(
+        select(sqlite_sequence.c.seq).where(sqlite_sequence.c.name == SkillLevelEvent.__tablename__)
+    ).scalar() or 0
+
+class SkillIndex:
+    def __init__(self):
+        self.postings = {} # skill_id -> {user_id: level}
+        self.senior = set() # user ids
+        self.versions = None
+        self.event_id = None # last skill_level_event applied
+        self._lock = threading.Lock()
+
+    def _build(self, versions):
+        event_id = last_event_id()
+        postings = {}
+        rows = db.session.execute(select(UserSkill.user_id, UserSkill.skill_id, UserSkill.level))
+        for user_id, skill_id, level in rows:
+            if level:
+                postings.setdefault(skill_id, {})[user_id] = level
+
+        self.postings = postings
+        self.senior = self._load_senior()
+        self.versions = versions
+        self.event_id = event_id
+
+    def _load_senior(self):
+        return set(db.session.execute(select(User.id).where(User.senior.is_(True))).scalars())
+
+    def _catch_up(self, versions):
+        event_id = last_event_id()
+        events = db.session.execute(
+            select(SkillLevelEvent.user_id, SkillLevelEvent.skill_id, SkillLevelEvent.level)
+            .where(SkillLevelEvent.id > self.event_id, SkillLevelEvent.id <= event_id)
+            .order_by(SkillLevelEvent.id)
+        ).all()
+        if len(events) != event_id - self.event_id:
+            return False
+        for user_id, skill_id, level in events:
+            if level:
+                self.postings.setdefault(skill_id, {})[user_id] = level
+            else:
+                self.postings.get(skill_id, {}).pop(user_id, None)
+        if versions[USERS] != self.versions[USERS]:
+            self.senior = self._load_senior()
+        self.versions = versions
+        self.event_id = event_id
+        return True
+
+    def _ensure_current(self):
+        versions = get_versions(USER_SKILLS, USERS)
+        if versions == self.versions:
+            return
+        if self.versions is None or not self._catch_up(versions):
+            self._build(versions)
+
+    def _advance(self, key, version):
+        # True if this worker's own write is the next change after what is indexed;
+        # otherwise the next lookup catches up with it
+        if self.versions is None or self.versions[key] != version - 1:
+            return False
+        self.versions[key] = version
+        return True
+
+    def apply_levels(self, user_id, levels, version):
+        with self._lock:
+            if not self._advance(USER_SKILLS, version):
+                return
+            for skill_id, level in levels.items():
+                if level:
+                    self.postings.setdefault(skill_id, {})[user_id] = level
+                else:
+                    self.postings.get(skill_id, {}).pop(user_id, None)
+
+    def remove_user(self, user_id, version):
+        with self._lock:
+            if not self._advance(USER_SKILLS, version):
+                return
+            for users in self.postings.values():
+                users.pop(user_id, None)
+
+    def set_senior(self, user_id, senior, version):
+        with self._lock:
+            if not self._advance(USERS, version):
+                return
+            if senior:
+                self.senior.add(user_id)
+            else:
+                self.senior.discard(user_id)
+
+    def find(self, constraints, min_matches=None, limit=50):
+        """Users holding at least min_matches of the (skill_id, min_level) constraints.
+
+        Returns (user_id, matched, total_level, levels) tuples ordered by number of
+        matched constraints, seniority and total level over the matched skills.
+        """
+        if min_matches is None:
+            min_matches = len(constraints)
+
+        with self._lock:
+            self._ensure_current()
+            qualified = [
+                (skill_id, {
+                    user_id: level
+                    for user_id, level in self.postings.get(skill_id, {}).items() if level >= min_level
+                })
+                for skill_id, min_level in constraints
+            ]
+
+            if min_matches == len(qualified):
+                # intersect starting from the shortest posting list
+                ordered = sorted(qualified, key=lambda item: len(item[1]))
+                candidates = set(ordered[0][1]) if ordered else set()
+                for _, users in ordered[1:]:
+                    candidates.intersection_update(users)
+            else:
+                counts = Counter()
+                for _, users in qualified:
+                    counts.update(users.keys())
+                candidates = [user_id for user_id, count in counts.items() if count >= min_matches]
+
+            results = []
+            for user_id in candidates:
+                levels = {skill_id: users[user_id] for skill_id, users in qualified if user_id in users}
+                results.append((user_id, len(levels), sum(levels.values()), levels, user_id in self.senior))
+
+        top = heapq.nsmallest(limit, results, key=lambda r: (-r[1], not r[4], -r[2], r[0]))
+        return [(user_id, matched, total, levels) for user_id, matched, total, levels, _ in top]
+
+skill_index = SkillIndex()
@@ -0,0 +1,37 @@
+import re
+from sqlalchemy import text
+from models import db
+
+# bm25 column weights: a hit in the skill name counts more than one in its path
+_SEARCH_SQL = text('''
+    SELECT skill.id, skill.name, skill.category_id, category.path,
+           ifnull(skill_stats.holders, 0) AS holders
+    FROM skill_search
+    JOIN skill ON skill.id = skill_search.rowid
+    LEFT JOIN category ON category.id = skill.category_id
+    LEFT JOIN skill_stats ON skill_stats.skill_id = skill.id
+    WHERE skill_search MATCH :query
+    ORDER BY bm25(skill_search, 10.0, 1.0), holders DESC, skill.name
+    LIMIT :limit
+''')
+
+def match_expression(q):
+    # every word is a quoted prefix term, so user input can't inject FTS syntax
+    words = re.findall(r'\w+', q or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_skills(q, limit=50):
+    query = match_expression(q)
+    if query is None:
+        return []
+
+    rows = db.session.execute(_SEARCH_SQL, {'query': query, 'limit': limit}).mappings()
+    return [{
+        'id': row['id'],
+        'name': row['name'],
+        'category_id': row['category_id'],
+        'path': row['path'] or '',
+        'holders': row['holders']
+    } for row in rows]
@@ -0,0 +1,394 @@
+import sys
+from flask import Blueprint, abort, jsonify, render_template, request, session
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import *
+from forms import *
+from auth import check_role
+from database import read_only
+from tree_cache import tree_cache
+from skill_search import search_skills
+from skill_index import skill_index
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+from http_cache import conditional
+from fragment_cache import apply_overlays, fragment_cache
+
+bp = Blueprint('skills', __name__)
+
+MAX_SKILLS_PER_REQUEST = 1000
+SEARCH_RESULTS = 50
+SUGGESTIONS = 10
+TEAM_FINDER_RESULTS = 50
+MAX_TEAM_FINDER_RESULTS = 500
+RECOMMENDATIONS = 5
+SKILL_HOLDERS_PER_PAGE = 50
+MAX_SKILL_HOLDERS_PER_PAGE = 500
+
+def recommendations_state():
+    # the recommendations depend on everybody's levels and change when a rebuild is swapped in.
+    # Not keyed on USER_SKILLS: a level change would invalidate every page; what this worker
+    # applies in place to the lists shows up with the user's own key, or with the next rebuild
+    from recommendations import recommendations
+    return recommendations.state()
+
+@bp.route('/', methods=['GET'])
+@read_only
+@check_role(['user', 'admin'])
+@conditional(TAXONOMY, lambda: user_key(session['id']), state=recommendations_state)
+def index():
+    from recommendations import recommendations
+
+    user = User.query.get_or_404(session.get('id'))
+    skills_info = user.get_skills()
+
+    categories_with_skills = {}
+    for skill in skills_info:
+        category = skill['category']
+        if category not in categories_with_skills:
+            categories_with_skills[category] = []
+
+        categories_with_skills[category].append({
+            'name': skill['skill_name'],
+            'level': skill['level']
+        })
+
+    tree = tree_cache.get()
+    similar = recommendations.similar_users_of(user.id, RECOMMENDATIONS)
+    colleagues = {colleague.id: colleague for colleague in User.query.filter(User.id.in_([user_id for user_id, _ in similar]))}
+    similar_users = [colleagues[user_id] for user_id, _ in similar if user_id in colleagues]
+    next_skills = [tree.skills[skill_id] for skill_id, _ in recommendations.next_skills_of(user.id, RECOMMENDATIONS) if skill_id in tree.skills]
+
+    return render_template('my_skills.html', categories_with_skills=categories_with_skills,
+                           similar_users=similar_users, next_skills=next_skills, categories=tree.categories)
+
+
+@bp.route('/skills', methods=['GET'])
+@read_only
+@check_role(['user', 'admin'])
+def skills():
+    # only the top level is rendered, subtrees are loaded from skills_tree on expand
+    categories_data = tree_cache.get().roots
+
+    return render_template('skills.html', categories_data=categories_data)
+
+def category_summary(category):
+    return {
+        'id': category.id,
+        'name': category.name,
+        'children': len(category.children),
+        'skills': len(category.skills)
+    }
+
+@bp.route('/api/skills/tree', methods=['GET'])
+@bp.route('/api/skills/tree/<int:category_id>', methods=['GET'])
+@read_only
+@check_role(['user', 'admin'])
+def skills_tree(category_id=None):
+    tree = tree_cache.get()
+    if category_id is None:
+        return jsonify({
+            'category': None,
+            'children': [category_summary(category) for category in tree.roots],
+            'skills': [],
+            'levels': {}
+        })
+
+    category = tree.categories.get(category_id)
+    if category is None:
+        return jsonify({'error': 'Unknown category'}), 404
+
+    skill_ids = [skill.id for skill in category.skills]
+    levels = {}
+    if skill_ids:
+        levels = dict(db.session.query(UserSkill.skill_id, UserSkill.level).filter(
+            UserSkill.user_id == session.get('id'),
+            UserSkill.skill_id.in_(skill_ids)
+        ).all())
+
+    return jsonify({
+        'category': {'id': category.id, 'name': category.name, 'path': category.path},
+        'children': [category_summary(child) for child in category.children],
+        'skills': [{'id': skill.id, 'name': skill.name} for skill in category.skills],
+        'levels': levels
+    })
+
+def parse_skill_levels(items):
+    levels = {}
+    errors = {}
+    skills = tree_cache.get().skills
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = {'item': ['Expected an object with skill_id and level']}
+            continue
+        form = UpdateSkillForm(formdata=None, data=item)
+        if not form.validate():
+            errors[index] = form.errors
+            continue
+        try:
+            skill_id = int(form.skill_id.data)
+        except (TypeError, ValueError):
+            skill_id = None
+        if skill_id not in skills:
+            errors[index] = {'skill_id': ['Unknown skill']}
+            continue
+        # later changes to the same skill win
+        levels[skill_id] = form.level.data
+
+    return levels, errors
+
+def set_user_skill_levels(user_id, levels):
+    upserts = [
+        {'user_id': user_id, 'skill_id': skill_id, 'level': level}
+        for skill_id, level in levels.items() if level > 0
+    ]
+    removed = [skill_id for skill_id, level in levels.items() if level == 0]
+
+    if upserts:
+        statement = sqlite_insert(UserSkill)
+        statement = statement.on_conflict_do_update(
+            index_elements=[UserSkill.user_id, UserSkill.skill_id],
+            set_={'level': statement.excluded.level},
+            where=UserSkill.level != statement.excluded.level
+        )
+        db.session.execute(statement, upserts)
+    if removed:
+        db.session.execute(
+            delete(UserSkill).where(UserSkill.user_id == user_id, UserSkill.skill_id.in_(removed))
+        )
+
+    version = bump_version(db.session.connection(), USER_SKILLS)
+    bump_versions(db.session.connection(), [user_key(user_id)] + [skill_key(skill_id) for skill_id in levels])
+    db.session.commit()
+    skill_index.apply_levels(user_id, levels, version)
+    # nothing to update in a worker that has not built its recommendations yet
+    if 'recommendations' in sys.modules:
+        from recommendations import recommendations
+        recommendations.apply_levels(user_id, levels, version)
+
+@bp.route('/set_skill', methods=['POST'])
+@check_role(['user', 'admin'])
+def update_skill():
+    data = request.get_json()
+
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+
+    levels, errors = parse_skill_levels([data])
+
+    if errors:
+        return jsonify({'error': 'Invalid data', 'details': errors[0]}), 400
+
+    [(skill_id, level)] = levels.items()
+    set_user_skill_levels(session.get('id'), levels)
+    return jsonify({'success': 'Skill updated', 'skill_id': skill_id, 'level': level})
+
+@bp.route('/set_skills', methods=['POST'])
+@check_role(['user', 'admin'])
+def update_skills():
+    data = request.get_json()
+    items = data.get('skills') if isinstance(data, dict) else None
+
+    if not items or not isinstance(items, list):
+        return jsonify({'error': 'No skills provided'}), 400
+
+    if len(items) > MAX_SKILLS_PER_REQUEST:
+        return jsonify({'error': f'At most {MAX_SKILLS_PER_REQUEST} skills per request'}), 400
+
+    levels, errors = parse_skill_levels(items)
+
+    if errors:
+        return jsonify({'error': 'Invalid data', 'details': errors}), 400
+
+    set_user_skill_levels(session.get('id'), levels)
+    return jsonify({
+        'success': 'Skills updated',
+        'skills': [{'skill_id': skill_id, 'level': level} for skill_id, level in levels.items()]
+    })
+
+@bp.route('/search', methods=['GET'])
+@read_only
+@conditional(TAXONOMY, USER_SKILLS)
+def search():
+    q = request.args.get('q', '').strip()
+    if q:
+        results = search_skills(q, limit=SEARCH_RESULTS)
+        return render_template('search.html', q=q, results=results)
+
+    tree = tree_cache.get()
+    html = fragment_cache.get(
+        ('search_tree', tree.version),
+        lambda: render_template('search_tree.html', categories=tree.roots)
+    )
+    user_counts = dict(db.session.query(SkillStats.skill_id, SkillStats.holders).all())
+    tree_html = apply_overlays(html, users=lambda skill_id: user_counts.get(int(skill_id), 0))
+    return render_template('search.html', q=q, tree_html=tree_html)
+
+@bp.route('/api/search/suggest', methods=['GET'])
+@read_only
+def search_suggest():
+    results = search_skills(request.args.get('q', ''), limit=SUGGESTIONS)
+    return jsonify({'results': results})
+
+@bp.route('/skill_details/<int:skill_id>', methods=['GET'])
+@read_only
+@conditional(TAXONOMY, USERS, skill_key, state=recommendations_state)
+def skill_details(skill_id):
+    from recommendations import recommendations
+
+    tree = tree_cache.get()
+    skill = tree.skills.get(skill_id)
+    if skill is None:
+        abort(404)
+
+    try:
+        holders, next_cursor = list_skill_holders(skill_id, request.args.get('after'), SKILL_HOLDERS_PER_PAGE)
+    except InvalidCursor:
+        abort(400)
+    next_args = dict(request.args.items(multi=False), after=next_cursor) if next_cursor else None
+    related_skills = [tree.skills[skill_id] for skill_id, _ in recommendations.related_skills_of(skill_id, RECOMMENDATIONS) if skill_id in tree.skills]
+    return render_template('skill_details.html', skill=skill, summary=skill_summary(skill_id), holders=holders,
+                           next_args=next_args, related_skills=related_skills, categories=tree.categories)
+
+@bp.route('/api/skill_details/<int:skill_id>', methods=['GET'])
+@read_only
+@check_role(['user', 'admin'])
+@conditional(TAXONOMY, USERS, skill_key)
+def skill_details_api(skill_id):
+    tree = tree_cache.get()
+    skill = tree.skills.get(skill_id)
+    if skill is None:
+        return jsonify({'error': 'Skill not found'}), 404
+
+    limit = min(request.args.get('limit', SKILL_HOLDERS_PER_PAGE, type=int), MAX_SKILL_HOLDERS_PER_PAGE)
+    try:
+        holders, next_cursor = list_skill_holders(skill_id, request.args.get('after'), max(limit, 1))
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({
+        'skill': {'id': skill.id, 'name': skill.name, 'category_id': skill.category_id,
+                  'path': tree.categories[skill.category_id].path},
+        'summary': skill_summary(skill_id),
+        'holders': [{
+            'user_id': holder.user_id,
+            'name': holder.name,
+            'surname': holder.surname,
+            'email': holder.email,
+            'senior': bool(holder.senior),
+            'level': holder.level,
+        } for holder in holders],
+        'next': next_cursor,
+    })
+
+def list_skill_holders(skill_id, after, limit):
+    # one joined query, seniors first then by level; keyset on (senior, level, id), all descending
+    senior = db.func.ifnull(User.senior, False, type_=db.Boolean)
+    query = (
+        select(UserSkill.id, UserSkill.user_id, UserSkill.level, User.name, User.surname, User.email,
+               senior.label('senior'))
+        .join(User, User.id == UserSkill.user_id)
+        .where(UserSkill.skill_id == skill_id, UserSkill.level > 0)
+    )
+
+    cursor = decode_cursor(after, int, int, int)
+    if cursor:
+        query = query.where(db.tuple_(senior, UserSkill.level, UserSkill.id) < db.tuple_(*cursor))
+
+    holders = db.session.execute(
+        query.order_by(senior.desc(), UserSkill.level.desc(), UserSkill.id.desc()).limit(limit + 1)
+    ).all()
+    next_cursor = None
+    if len(holders) > limit:
+        holders = holders[:limit]
+        last = holders[-1]
+        next_cursor = encode_cursor([int(last.senior), last.level, last.id])
+    return holders, next_cursor
+
+def skill_summary(skill_id):
+    """Level histogram and senior/junior split of a skill's holders, from one GROUP BY."""
+    senior = db.func.ifnull(User.senior, False, type_=db.Boolean)
+    rows = db.session.execute(
+        select(senior, UserSkill.level, db.func.count())
+        .join(User, User.id == UserSkill.user_id)
+        .where(UserSkill.skill_id == skill_id, UserSkill.level > 0)
+        .group_by(senior, UserSkill.level)
+    ).all()
+
+    levels = dict.fromkeys(LEVELS, 0)
+    holders = {True: 0, False: 0}
+    level_sums = {True: 0, False: 0}
+    for is_senior, level, count in rows:
+        if level in levels:
+            levels[level] += count
+        holders[bool(is_senior)] += count
+        level_sums[bool(is_senior)] += level * count
+
+    def average(total, count):
+        return round(total / count, 1) if count else 0
+
+    return {
+        'holders': holders[True] + holders[False],
+        'avg_level': average(level_sums[True] + level_sums[False], holders[True] + holders[False]),
+        'senior_holders': holders[True],
+        'senior_avg_level': average(level_sums[True], holders[True]),
+        'junior_holders': holders[False],
+        'junior_avg_level': average(level_sums[False], holders[False]),
+        'levels': list(levels.values()),
+    }
+
+def parse_team_constraints(args):
+    constraints = []
+    errors = []
+    skills = tree_cache.get().skills
+
+    for value in args.getlist('skill'):
+        skill_id, _, min_level = value.partition(':')
+        try:
+            skill_id = int(skill_id)
+            min_level = int(min_level or 1)
+        except ValueError:
+            errors.append(f'Invalid constraint "{value}", expected skill_id:min_level')
+            continue
+        if skill_id not in skills:
+            errors.append(f'Unknown skill {skill_id}')
+        elif min_level not in LEVELS:
+            errors.append(f'Invalid level {min_level} for skill {skill_id}')
+        else:
+            constraints.append((skill_id, min_level))
+
+    if not constraints and not errors:
+        errors.append('At least one skill constraint is required')
+
+    min_matches = args.get('min_matches', len(constraints), type=int)
+    if constraints and not 1 <= min_matches <= len(constraints):
+        errors.append(f'min_matches must be between 1 and {len(constraints)}')
+
+    return constraints, min_matches, errors
+
+@bp.route('/api/team_finder', methods=['GET'])
+@read_only
+@check_role(['user', 'admin'])
+def team_finder():
+    # e.g. /api/team_finder?skill=12:4&skill=7:3&skill=9:2&min_matches=2
+    constraints, min_matches, errors = parse_team_constraints(request.args)
+    if errors:
+        return jsonify({'error': 'Invalid data', 'details': errors}), 400
+
+    limit = max(1, min(request.args.get('limit', TEAM_FINDER_RESULTS, type=int), MAX_TEAM_FINDER_RESULTS))
+    matches = skill_index.find(constraints, min_matches=min_matches, limit=limit)
+
+    users = {user.id: user for user in User.query.filter(User.id.in_([match[0] for match in matches]))}
+    return jsonify({
+        'constraints': [{'skill_id': skill_id, 'min_level': min_level} for skill_id, min_level in constraints],
+        'min_matches': min_matches,
+        'users': [{
+            'id': user_id,
+            'name': users[user_id].name,
+            'surname': users[user_id].surname,
+            'email': users[user_id].email,
+            'senior': users[user_id].senior,
+            'matched': matched,
+            'total_level': total,
+            'levels': [{'skill_id': skill_id, 'level': level} for skill_id, level in levels.items()]
+        } for user_id, matched, total, levels in matches if user_id in users]
+    })
@@ -0,0 +1,60 @@
+
+const SUGGEST_DELAY_MS = 150;
+
+document.addEventListener('DOMContentLoaded', () => {
+    const input = document.getElementById('skill-search');
+    const suggestions = document.getElementById('skill-suggestions');
+    let timer = null;
+    let controller = null;
+
+    function clearSuggestions() {
+        suggestions.replaceChildren();
+    }
+
+    function showSuggestions(results) {
+        clearSuggestions();
+        results.forEach(skill => {
+            const item = document.createElement('a');
+            item.className = 'list-group-item list-group-item-action';
+            item.href = `/skill_details/${skill.id}`;
+            item.textContent = `${skill.name} (${skill.holders})`;
+
+            const path = document.createElement('small');
+            path.className = 'text-muted ms-2';
+            path.textContent = skill.path;
+            item.appendChild(path);
+
+            suggestions.appendChild(item);
+        });
+    }
+
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        const q = input.value.trim();
+        if (!q) {
+            clearSuggestions();
+            return;
+        }
+        timer = setTimeout(() => {
+            // only the latest request matters
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            fetch(`/api/search/suggest?q=${encodeURIComponent(q)}`, {signal: controller.signal})
+                .then(response => response.json())
+                .then(data => showSuggestions(data.results))
+                .catch(error => {
+                    if (error.name !== 'AbortError') {
+                        console.error('Error:', error);
+                    }
+                });
+        }, SUGGEST_DELAY_MS);
+    });
+
+    input.addEventListener('keydown', event => {
+        if (event.key === 'Escape') {
+            clearSuggestions();
+        }
+    });
+});
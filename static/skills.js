@@ -1,38 +1,180 @@
 
-document.addEventListener('DOMContentLoaded', () => {
-    document.querySelectorAll('.update-skill-form input[type="radio"]').forEach(input => {
-        input.addEventListener('change', function() {
-            const form = this.closest('.update-skill-form');
-            const skillItem = form.closest('.skill-item');
-            const skillId = skillItem.getAttribute('data-skill-id');
-            const level = this.value;
-            const csrfToken = form.csrf_token.value;
-
-            fetch('/set_skill', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRF-Token': csrfToken
-                },
-                body: JSON.stringify({skill_id: skillId, level: level})
-            })
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Network response was not ok');
-                }
-                return response.json();
-            })
-            .then(data => {
-                console.log('Success:', data);
-                if (level == 0) {
-                    skillItem.querySelector('.skill-level').textContent = 'N/A';
-                } else {
-                    skillItem.querySelector('.skill-level').textContent = level;
-                }
-            })
-            .catch((error) => {
-                console.error('Error:', error);
-            });
+// Level changes are collected for a short while and sent to /set_skills in a
+// single request, so filling in the whole page costs a few round trips
+// instead of one per click.
+const FLUSH_DELAY_MS = 800;
+const MAX_LEVEL = 5;
+
+const pendingLevels = new Map();
+let flushTimer = null;
+
+function csrfToken() {
+    const meta = document.querySelector('meta[name="csrf-token"]');
+    return meta ? meta.content : '';
+}
+
+function showLevel(skillId, level) {
+    const skillItem = document.querySelector(`.skill-item[data-skill-id="${skillId}"]`);
+    if (!skillItem) {
+        return;
+    }
+    skillItem.querySelector('.skill-level').textContent = level == 0 ? 'N/A' : level;
+    skillItem.querySelector('.skill-name').classList.toggle('checked-skill', level != 0);
+}
+
+function flushLevels(keepalive = false) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+    if (pendingLevels.size === 0) {
+        return;
+    }
+
+    const skills = Array.from(pendingLevels, ([skill_id, level]) => ({skill_id, level}));
+    pendingLevels.clear();
+
+    fetch('/set_skills', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRF-Token': csrfToken()
+        },
+        body: JSON.stringify({skills: skills}),
+        keepalive: keepalive
+    })
+    .then(response => {
+        if (!response.ok) {
+            throw new Error('Network response was not ok');
+        }
+        return response.json();
+    })
+    .then(data => {
+        console.log('Success:', data);
+        data.skills.forEach(skill => showLevel(skill.skill_id, skill.level));
+    })
+    .catch((error) => {
+        console.error('Error:', error);
+    });
+}
+
+function queueLevel(skillId, level) {
+    pendingLevels.set(skillId, level);
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(flushLevels, FLUSH_DELAY_MS);
+}
+
+function renderCategory(category) {
+    const item = document.createElement('li');
+    item.className = 'category-item';
+    item.dataset.categoryId = category.id;
+
+    const toggle = document.createElement('button');
+    toggle.type = 'button';
+    toggle.className = 'btn btn-link p-0 toggle-category';
+    toggle.textContent = `▸ ${category.name}`;
+
+    const content = document.createElement('div');
+    content.className = 'category-content';
+    content.hidden = true;
+
+    item.append(toggle, content);
+    return item;
+}
+
+function renderSkill(skill, level) {
+    const item = document.createElement('li');
+    item.className = 'skill-item';
+    item.dataset.skillId = skill.id;
+    item.style.display = 'flex';
+    item.style.alignItems = 'center';
+
+    const name = document.createElement('span');
+    name.className = level ? 'skill-name checked-skill' : 'skill-name';
+    name.textContent = skill.name;
+
+    const current = document.createElement('span');
+    current.className = 'skill-level';
+    current.textContent = level ? level : 'N/A';
+
+    const form = document.createElement('form');
+    form.className = 'update-skill-form';
+    form.style.display = 'flex';
+    form.style.gap = '5px';
+    form.style.marginLeft = '10px';
+    for (let i = 0; i <= MAX_LEVEL; i++) {
+        const label = document.createElement('label');
+        const input = document.createElement('input');
+        input.type = 'radio';
+        input.name = 'level';
+        input.value = i;
+        input.checked = i === level;
+        label.append(input, ` ${i}`);
+        form.appendChild(label);
+    }
+
+    item.append(name, ' - Level: ', current, form);
+    return item;
+}
+
+function renderSubtree(content, data) {
+    if (data.skills.length) {
+        const list = document.createElement('ul');
+        list.className = 'skill-list';
+        data.skills.forEach(skill => list.appendChild(renderSkill(skill, data.levels[skill.id] || 0)));
+        content.appendChild(list);
+    }
+    if (data.children.length) {
+        const list = document.createElement('ul');
+        list.className = 'category-list';
+        data.children.forEach(child => list.appendChild(renderCategory(child)));
+        content.appendChild(list);
+    }
+}
+
+function toggleCategory(item) {
+    const content = item.querySelector(':scope > .category-content');
+    const toggle = item.querySelector(':scope > .toggle-category');
+    const expanding = content.hidden;
+    content.hidden = !expanding;
+    toggle.textContent = toggle.textContent.replace(/^[▸▾]/, expanding ? '▾' : '▸');
+
+    if (!expanding || item.dataset.loaded) {
+        return;
+    }
+    item.dataset.loaded = 'true';
+    fetch(`/api/skills/tree/${item.dataset.categoryId}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.json();
+        })
+        .then(data => renderSubtree(content, data))
+        .catch((error) => {
+            delete item.dataset.loaded;
+            console.error('Error:', error);
         });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    // subtrees are rendered on demand, so listen on the document
+    document.addEventListener('click', event => {
+        const toggle = event.target.closest('.toggle-category');
+        if (toggle) {
+            toggleCategory(toggle.closest('.category-item'));
+        }
     });
+    document.addEventListener('change', event => {
+        if (event.target.matches('.update-skill-form input[type="radio"]')) {
+            const skillItem = event.target.closest('.skill-item');
+            queueLevel(skillItem.dataset.skillId, event.target.value);
+        }
+    });
+});
+
+// don't lose changes made right before leaving the page
+window.addEventListener('pagehide', () => flushLevels(true));
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        flushLevels(true);
+    }
 });
@@ -0,0 +1,123 @@
+from flask import Blueprint, flash, redirect, render_template, url_for
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import select
+from models import *
+from forms import *
+from auth import check_role
+from database import read_only
+from tree_cache import tree_cache
+from http_cache import conditional
+from fragment_cache import apply_overlays, fragment_cache
+
+bp = Blueprint('taxonomy', __name__)
+
+@bp.route('/categories', methods=['GET'])
+@read_only
+@check_role(['admin'])
+@conditional(TAXONOMY, forms=True)
+def categories():
+    tree = tree_cache.get()
+    html = fragment_cache.get(
+        ('categories_tree', tree.version),
+        lambda: render_template('categories_tree.html', categories=tree.roots)
+    )
+    token = generate_csrf()
+    tree_html = apply_overlays(html, csrf_token=lambda _: token)
+
+    return render_template('categories.html', tree_html=tree_html)
+
+@bp.route('/create_category', methods=['GET', 'POST'])
+@check_role(['admin'])
+def create_category():
+    form = CreateCategoryForm()
+    tree = tree_cache.get()
+    form.parent_id.choices += [(category.id, category.name) for category in tree.categories.values()]
+
+    if form.validate_on_submit():
+        name = form.name.data
+        parent_id = form.parent_id.data if form.parent_id.data != 0 else None
+
+        if parent_id is not None:
+            parent_category = tree.categories[parent_id]
+            if parent_category.skills:
+                flash('Cannot create subcategory because the parent category has associated skills.', 'error')
+                return redirect(url_for('taxonomy.create_category'))
+        new_category = Category(name=name, parent_id=parent_id)
+        db.session.add(new_category)
+        db.session.commit()
+        return redirect(url_for('taxonomy.categories'))
+    else:
+        flash_errors(form)
+
+    return render_template('create_category.html', form=form)
+
+@bp.route('/delete_category', methods=['POST'])
+@check_role(['admin'])
+def delete_category():
+    form = DeleteCategoryForm()
+    if form.validate_on_submit():
+        category_id = form.category_id.data
+        category = Category.query.get_or_404(category_id)
+        categories, skills, levels = delete_category_tree(db.session.connection(), category.id)
+        model_audit_log(
+            action='delete category',
+            data={
+                'category_id': category.id,
+                'category_name': category.name,
+                'categories': categories,
+                'skills': skills,
+                'user_skills': levels,
+            })
+        db.session.commit()
+    return redirect(url_for('taxonomy.categories'))
+
+@bp.route('/showskills/<int:category_id>', methods=['GET'])
+@read_only
+@check_role(['admin'])
+def show_skills(category_id):
+    form = CreateSkillForm()
+    category = Category.query.get_or_404(category_id)
+    # get skills ordered by name
+    skills = Skill.query.options(db.joinedload(Skill.stats)).filter_by(category_id=category_id).order_by(Skill.name).all()
+    return render_template('show_skills.html', category=category, skills=skills, form=form)
+
+@bp.route('/createskill/<int:category_id>', methods=['POST'])
+@check_role(['admin'])
+def create_skill(category_id):
+    category = Category.query.get_or_404(category_id)
+    # only leaf
+    if category.children:
+        return redirect(url_for('taxonomy.show_skills', category_id=category_id))
+
+    form = CreateSkillForm()
+    if form.validate_on_submit():
+        name = form.name.data
+        new_skill = Skill(name=name, category_id=category_id)
+        db.session.add(new_skill)
+        db.session.commit()
+        return redirect(url_for('taxonomy.show_skills', category_id=category_id))
+
+    redirect(url_for('taxonomy.show_skills', category_id=category_id))
+
+@bp.route('/deleteskill', methods=['POST'])
+@check_role(['admin'])
+def delete_skill():
+    form = DeleteSkillForm()
+    category_id = None
+    if form.validate_on_submit():
+        skill_id = form.skill_id.data
+        skill = Skill.query.get_or_404(skill_id)
+        category_id = skill.category_id
+        levels = delete_skills(db.session.connection(), select(Skill.id).where(Skill.id == skill.id))
+        model_audit_log(
+            action='delete skill',
+            data={
+                'skill_id': skill.id,
+                'skill_name': skill.name,
+                'user_skills': levels,
+            })
+        db.session.commit()
+
+    if category_id is None:
+        return redirect(url_for('taxonomy.categories'))
+    return redirect(url_for('taxonomy.show_skills', category_id=category_id))
@@ -0,0 +1,80 @@
+import threading
+from sqlalchemy import select
+from models import db, Category, Skill, TAXONOMY, get_version
+
+# The category/skill taxonomy changes rarely but is rendered on almost every
+# page. Each worker keeps a read-only copy of the tree and rebuilds it only when
+# the taxonomy version stored in the database moves, so all workers stay
+# coherent without any extra service.
+
+class CategoryNode:
+    __slots__ = ('id', 'name', 'path', 'parent_id', 'children', 'skills')
+
+    def __init__(self, id, name, path, parent_id):
+        self.id = id
+        self.name = name
+        self.path = path
+        self.parent_id = parent_id
+        self.children = []
+        self.skills = []
+
+class SkillNode:
+    __slots__ = ('id', 'name', 'category_id')
+
+    def __init__(self, id, name, category_id):
+        self.id = id
+        self.name = name
+        self.category_id = category_id
+
+class CategoryTree:
+    def __init__(self, version, roots, categories, skills):
+        self.version = version
+        self.roots = roots
+        self.categories = categories # id -> CategoryNode
+        self.skills = skills # id -> SkillNode
+
+def build_tree(version):
+    category_rows = db.session.execute(
+        select(Category.id, Category.name, Category.path, Category.parent_id).order_by(Category.id)
+    ).all()
+    skill_rows = db.session.execute(
+        select(Skill.id, Skill.name, Skill.category_id).order_by(Skill.name)
+    ).all()
+
+    categories = {row.id: CategoryNode(row.id, row.name, row.path, row.parent_id) for row in category_rows}
+    roots = []
+    for category in categories.values():
+        if category.parent_id in categories:
+            categories[category.parent_id].children.append(category)
+        else:
+            roots.append(category)
+
+    skills = {}
+    for row in skill_rows:
+        skill = SkillNode(row.id, row.name, row.category_id)
+        skills[skill.id] = skill
+        if skill.category_id in categories:
+            categories[skill.category_id].skills.append(skill)
+
+    return CategoryTree(version, roots, categories, skills)
+
+class CategoryTreeCache:
+    def __init__(self):
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = get_version(TAXONOMY)
+        tree = self._tree
+        if tree is not None and tree.version == version:
+            return tree
+
+        with self._lock:
+            if self._tree is None or self._tree.version != version:
+                self._tree = build_tree(version)
+            return self._tree
+
+    def clear(self):
+        self._tree = None
+
+tree_cache = CategoryTreeCache()